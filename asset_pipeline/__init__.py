@@ -8,6 +8,7 @@ from .pipeline import AbstractAssetPipeline, \
     PlatformSpecificAssetPipelineMixin
 from .protocol import *
 from .chunked_upload import ChunkedUploadMixin
+from .green import GreenRemoteAssetPipeline
 
 __all__ = [
     'logger',
@@ -17,7 +18,8 @@ __all__ = [
     'PlatformSpecificAssetPipelineMixin',
     'ConversionState',
     'MessageType',
-    'ChunkedUploadMixin'
+    'ChunkedUploadMixin',
+    'GreenRemoteAssetPipeline'
 ]
 
 if __name__ == '__main__':
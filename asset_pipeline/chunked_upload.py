@@ -1,87 +1,395 @@
 import hashlib
+import mmap
+import threading
+import time
+import uuid
 import requests
+from multiprocessing.pool import ThreadPool
 from urlparse import urljoin
 from io import BytesIO
 from os import path
 
+from logger import logger
+from protocol import TMP_FILES_PATH
+from upload_journal import get_upload_journal
 
-def _generate_md5_hash_for_file_at_path(file_path):
+
+class _FileChunkReader(object):
+    """
+    reads a file chunk by chunk, updating the given hashing function with every chunk read
+    """
+    def __init__(self, file_path, hashing_function):
+        self.name = path.basename(file_path)
+        self.hashing_function = hashing_function
+        self._file = open(file_path, 'rb')
+
+    def read(self, size):
+        piece = self._file.read(size)
+        self.hashing_function.update(piece)
+        return piece
+
+    def iter_chunks(self, chunk_size):
+        """
+        yields all remaining chunks (ready to be uploaded) along with their size
+        :param chunk_size: object deciding on the size of each chunk
+        """
+        while True:
+            piece = self.read(chunk_size.next_size())
+            if not len(piece):
+                break
+            yield self.to_chunk(piece), len(piece)
+
+    def to_chunk(self, piece):
+        chunk = BytesIO(piece)
+        chunk.name = self.name
+        return chunk
+
+    def close(self):
+        self._file.close()
+
+
+class _MemoryMappedChunkReader(_FileChunkReader):
+    """
+    reads a memory mapped file chunk by chunk. Chunks are buffers pointing into the mapped file, so neither reading
+    nor uploading them copies the file's contents into memory
+    """
+    def __init__(self, file_path, hashing_function):
+        super(_MemoryMappedChunkReader, self).__init__(file_path, hashing_function)
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._position = 0
+
+    def read(self, size):
+        piece = buffer(self._mmap, self._position, size)
+        self._position += len(piece)
+        self.hashing_function.update(piece)
+        return piece
+
+    def to_chunk(self, piece):
+        return _MultipartChunkBody(piece, self.name)
+
+    def close(self):
+        self._mmap.close()
+        super(_MemoryMappedChunkReader, self).close()
+
+
+class _FixedChunkSize(object):
     """
-    computes md5 hash for file at given path
+    hands out the same size for every chunk
     """
-    block_size = 65536
-    hashing_function = hashlib.md5()
-    with open(file_path, 'rb') as afile:
-        buf = afile.read(block_size)
-        while len(buf) > 0:
-            hashing_function.update(buf)
-            buf = afile.read(block_size)
-    return hashing_function.hexdigest()
+    def __init__(self, size):
+        self.size = size
+
+    def next_size(self):
+        return self.size
+
+    def record(self, size, duration):
+        pass
+
+
+class _AdaptiveChunkSize(_FixedChunkSize):
+    """
+    grows or shrinks the size of the next chunk based on the throughput measured for the previous ones, so that
+    uploading a chunk takes about target_duration seconds
+    """
+    # chunk sizes are kept at multiples of this size
+    granularity = 64 << 10
+
+    def __init__(self, size, min_size, max_size, target_duration):
+        super(_AdaptiveChunkSize, self).__init__(size)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_duration = target_duration
+        self.sizes = []
+        self.lock = threading.Lock()
+
+    def next_size(self):
+        with self.lock:
+            self.sizes.append(self.size)
+            return self.size
+
+    def record(self, size, duration):
+        with self.lock:
+            ideal_size = size * self.target_duration / max(duration, 0.001)
+            # don't let a single slow or fast chunk change the size too drastically
+            ideal_size = min(max(ideal_size, self.size / 2), self.size * 2)
+            ideal_size = min(max(ideal_size, self.min_size), self.max_size)
+            granularity = min(self.granularity, self.min_size)
+            new_size = max(int(ideal_size) // granularity * granularity, self.min_size)
+            if new_size != self.size:
+                logger.debug('Chunk of %s bytes took %.2fs, changing chunk size from %s to %s bytes' % (
+                    size, duration, self.size, new_size
+                ))
+                self.size = new_size
+
+
+class _MultipartChunkBody(object):
+    """
+    streaming multipart/form-data request body containing a single chunk. The chunk's data is handed out in
+    slices as the request is sent, instead of being copied into one big request body first
+    """
+    def __init__(self, data, name, field_name='chunk'):
+        self.name = name
+        boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={0}'.format(boundary)
+        self._parts = [
+            '--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{name}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'.format(boundary=boundary, field=field_name, name=name),
+            data,
+            '\r\n--{boundary}--\r\n'.format(boundary=boundary)
+        ]
+        self._length = sum(len(part) for part in self._parts)
+        self._position = 0
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for part in self._parts:
+            yield part
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        # only needed to rewind the body before sending it again
+        self._position = offset
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self._length - self._position
+        part_start = 0
+        for part in self._parts:
+            if self._position < part_start + len(part):
+                piece = buffer(part, self._position - part_start, size)
+                self._position += len(piece)
+                return piece
+            part_start += len(part)
+        return ''
 
 
 class ChunkedUploadMixin(object):
-    def upload_chunked_file(self, base_url=None, file_path=None, early_return_on_error=True, md5=None):
-        response = self._chunked_upload_file(base_url, file_path, early_return_on_error, md5)
+    # number of chunks which are uploaded at the same time once the upload has been created on the server side
+    parallel_chunk_uploads = 1
+    # file in which the progress of chunked uploads is persisted, so interrupted uploads can be resumed
+    # (set to None in order to disable resuming uploads)
+    upload_journal_path = path.join(TMP_FILES_PATH, 'chunked_uploads.json')
+    # whether or not to memory map the file and stream the chunks straight out of it, which keeps the memory
+    # used per upload constant, no matter how large the chunks are
+    memory_mapped_uploads = False
+    # whether or not to adapt the chunk size to the measured throughput, so every chunk takes about
+    # target_chunk_duration seconds to upload (within the bounds of min_chunk_size_bytes and max_chunk_size_bytes)
+    adaptive_chunk_size = False
+    min_chunk_size_bytes = 256 << 10
+    max_chunk_size_bytes = 64 << 20
+    target_chunk_duration = 2.0
+
+    def upload_chunked_file(self, base_url=None, file_path=None, early_return_on_error=True, md5=None,
+                            parallel_uploads=None, progress_callback=None):
+        response = self._chunked_upload_file(
+            base_url, file_path, early_return_on_error, md5, parallel_uploads=parallel_uploads,
+            progress_callback=progress_callback
+        )
         if response.status_code != requests.codes.ok:
             print response
             raise Exception('Could not upload file.')
         return response.json()['file_url']
 
-    def _chunked_upload_file(self, base_url=None, file_path=None, early_return_on_error=True, md5=None, chunk_size_bytes=2<<20):
+    def _chunked_upload_file(self, base_url=None, file_path=None, early_return_on_error=True, md5=None, chunk_size_bytes=2<<20,
+                             parallel_uploads=None, progress_callback=None):
         """
         create generic models with chunkeduploads
 
-        :param chunk_size_bytes: default value is 2 MiB
-        """    
+        uploads which got interrupted (e.g. by a network error or a restart of the pipeline) are resumed at the last
+        offset acknowledged by the server, as long as the file did not change in the meantime
+
+        :param chunk_size_bytes: default value is 2 MiB (the initial size when adapting the chunk size)
+        :param parallel_uploads: number of chunks to be kept in flight at the same time after the first chunk has
+        been uploaded, defaults to parallel_chunk_uploads
+        :param progress_callback: function called with the number of bytes acknowledged by the server so far and
+        the file's size (e.g. a pipeline's report_progress)
+        """
+        if parallel_uploads is None:
+            parallel_uploads = self.parallel_chunk_uploads
 
         chunked_upload_url_suffix = 'chunked_uploads/'
         chunked_upload_commit_suffix = 'commit/'
 
-        # initial post request to create a new chunked upload instance on the backend side
-        file_size = path.getsize(file_path)
-        with open(file_path, 'rb') as _file:
-            def read_chunk():
-                return _file.read(chunk_size_bytes)
+        # the md5 hash is computed from the very same chunks we upload, so the file is only read once
+        hashing_function = hashlib.md5()
 
-            # reset the offset
-            offset = 0
+        initial_url = urljoin(base_url, chunked_upload_url_suffix)
+        journal = get_upload_journal(self.upload_journal_path) if self.upload_journal_path else None
+        journal_entry = journal.get(file_path) if journal else None
+        resumed = journal_entry is not None and journal_entry['url'] == initial_url
 
-            # First chunk returns some special information
-            chunk = BytesIO(read_chunk())
-            chunk.name = path.basename(file_path)
-            initial_url = urljoin(base_url, chunked_upload_url_suffix)
-            response = self._upload_first_chunk_of_file(chunk, initial_url)
-            if response.status_code is not requests.codes.ok and early_return_on_error:
-                return response
+        def restart_upload():
+            # the server doesn't know about the upload we tried to resume (anymore), so start over from scratch
+            logger.warn('Could not resume chunked upload of %s, restarting it' % file_path)
+            journal.remove(file_path)
+            return self._chunked_upload_file(
+                base_url, file_path, early_return_on_error, md5, chunk_size_bytes, parallel_uploads, progress_callback
+            )
 
-            # fill md5sum and upload_id received from server, required for subsequent requests
-            upload_id = response.json()['upload_id']
+        def acknowledge(acknowledged_offset):
+            if journal:
+                journal.record(file_path, initial_url, upload_id, acknowledged_offset)
+            if progress_callback and file_size > 0:
+                progress_callback(acknowledged_offset, file_size)
 
-            # remember the upload offset
-            offset = response.json()['offset']
+        if self.adaptive_chunk_size:
+            chunk_size = _AdaptiveChunkSize(
+                chunk_size_bytes, self.min_chunk_size_bytes, self.max_chunk_size_bytes, self.target_chunk_duration
+            )
+        else:
+            chunk_size = _FixedChunkSize(chunk_size_bytes)
 
-            # Continue with other chunks (every other chunk needs to also reference the upload's id
-            add_chunk_url = urljoin(initial_url, '{0}/'.format(upload_id))
-            for piece in iter(read_chunk, ''):
-                chunk = BytesIO(piece)
-                chunk.name = path.basename(file_path)
-                response = self._upload_chunk(offset, file_size, chunk, len(piece), add_chunk_url)
+        def upload_chunk(chunk_offset, chunk, size):
+            start_time = time.time()
+            response = self._upload_chunk(chunk_offset, file_size, chunk, size, add_chunk_url)
+            if response.status_code is requests.codes.ok:
+                chunk_size.record(size, time.time() - start_time)
+            return response
+
+        file_size = path.getsize(file_path)
+        # empty files can't be memory mapped
+        if self.memory_mapped_uploads and file_size > 0:
+            reader = _MemoryMappedChunkReader(file_path, hashing_function)
+        else:
+            reader = _FileChunkReader(file_path, hashing_function)
+        try:
+            if resumed:
+                upload_id = journal_entry['upload_id']
+                offset = journal_entry['offset']
+                logger.info('Resuming chunked upload of %s at offset %s' % (file_path, offset))
+                # the part which has already been uploaded still needs to be part of the md5 hash
+                remaining = offset
+                while remaining > 0:
+                    remaining -= len(reader.read(min(remaining, chunk_size_bytes)))
+            else:
+                # initial post request to create a new chunked upload instance on the backend side
+                # First chunk returns some special information
+                piece = reader.read(chunk_size.next_size())
+                start_time = time.time()
+                response = self._upload_first_chunk_of_file(reader.to_chunk(piece), initial_url)
                 if response.status_code is not requests.codes.ok and early_return_on_error:
                     return response
-                # update the offset
+                chunk_size.record(len(piece), time.time() - start_time)
+
+                # fill md5sum and upload_id received from server, required for subsequent requests
+                upload_id = response.json()['upload_id']
+
+                # remember the upload offset
                 offset = response.json()['offset']
+                acknowledge(offset)
+
+            # Continue with other chunks (every other chunk needs to also reference the upload's id
+            add_chunk_url = urljoin(initial_url, '{0}/'.format(upload_id))
+            chunks = reader.iter_chunks(chunk_size)
+            if parallel_uploads > 1:
+                response = self._upload_chunks_in_parallel(
+                    chunks, offset, upload_chunk, parallel_uploads, early_return_on_error, on_acknowledged=acknowledge
+                )
+                if response is not None and early_return_on_error:
+                    return restart_upload() if resumed and response.status_code < 500 else response
+            else:
+                for chunk, size in chunks:
+                    response = upload_chunk(offset, chunk, size)
+                    if response.status_code is not requests.codes.ok and early_return_on_error:
+                        return restart_upload() if resumed and response.status_code < 500 else response
+                    # update the offset
+                    offset = response.json()['offset']
+                    acknowledge(offset)
+        finally:
+            reader.close()
+
+        if self.adaptive_chunk_size and chunk_size.sizes:
+            logger.info('Uploaded %s in chunks of %s to %s bytes' % (
+                file_path, min(chunk_size.sizes), max(chunk_size.sizes)
+            ))
 
         # final post including the file's md5 hash
         commit_chunked_upload_url = urljoin(add_chunk_url, chunked_upload_commit_suffix)
-        # auto-generate the md5 hash (unless an explicit hash has been provided for testing reason)
+        # use the md5 hash generated while uploading (unless an explicit hash has been provided for testing reason)
         if md5 is None:
-            md5 = _generate_md5_hash_for_file_at_path(file_path)
+            md5 = hashing_function.hexdigest()
         response = self._commit_chunked_upload(md5, commit_chunked_upload_url)
         if response.status_code is not requests.codes.ok and early_return_on_error:
-            return response
+            return restart_upload() if resumed and response.status_code < 500 else response
+
+        # the upload is done, nothing left to resume
+        if journal:
+            journal.remove(file_path)
 
         return response
 
+    def _upload_chunks_in_parallel(self, chunks, offset, upload_chunk, parallel_uploads, early_return_on_error=True,
+                                   on_acknowledged=None):
+        """
+        Helper function that uploads all remaining chunks while keeping up to parallel_uploads of them in flight.
+        As we can't wait for the server to tell us the next offset, every chunk's position is sent explicitly via
+        its Content-Range header.
+
+        :param chunks: iterable of the remaining chunks to be uploaded along with their size
+        :param offset: the offset at which the first of the remaining chunks starts
+        :param upload_chunk: callable uploading the chunk (given its offset, the chunk and its size)
+        :param parallel_uploads: the maximum number of chunks being uploaded at the same time
+        :param early_return_on_error: whether or not to stop sending further chunks once a chunk failed
+        :param on_acknowledged: optional callable receiving the offset up to which all chunks have been acknowledged
+        :return: the response of the first failed chunk or None if all chunks have been acknowledged
+        """
+        # limits the number of chunks read into memory but not yet uploaded
+        in_flight = threading.BoundedSemaphore(parallel_uploads)
+        failed_responses = []
+        # exceptions raised while uploading chunks (e.g. because the connection broke down)
+        errors = []
+        # chunks are acknowledged out of order, so keep track of the offset up to which there are no gaps
+        acknowledged_lock = threading.Lock()
+        acknowledged_chunks = {}
+        acknowledged_offset = [offset]
+
+        def upload(chunk_offset, chunk, chunk_size):
+            try:
+                response = upload_chunk(chunk_offset, chunk, chunk_size)
+                if response.status_code is not requests.codes.ok:
+                    failed_responses.append(response)
+                elif on_acknowledged is not None:
+                    with acknowledged_lock:
+                        acknowledged_chunks[chunk_offset] = chunk_offset + chunk_size
+                        while acknowledged_offset[0] in acknowledged_chunks:
+                            acknowledged_offset[0] = acknowledged_chunks.pop(acknowledged_offset[0])
+                        on_acknowledged(acknowledged_offset[0])
+            except Exception as e:
+                # stop reading any further chunks, the exception is re-raised once the pending uploads are done
+                errors.append(e)
+                raise
+            finally:
+                in_flight.release()
+
+        pool = ThreadPool(processes=parallel_uploads)
+        try:
+            pending_uploads = []
+            chunks = iter(chunks)
+            while True:
+                # wait until there's a free slot before reading the next chunk
+                in_flight.acquire()
+                if errors or (failed_responses and early_return_on_error):
+                    in_flight.release()
+                    break
+                try:
+                    chunk, chunk_size = next(chunks)
+                except StopIteration:
+                    in_flight.release()
+                    break
+                pending_uploads.append(pool.apply_async(upload, (offset, chunk, chunk_size)))
+                offset += chunk_size
+            # wait for all chunks to be acknowledged (re-raises any exception which occurred while uploading)
+            for pending_upload in pending_uploads:
+                pending_upload.get()
+        finally:
+            pool.close()
+            pool.join()
+        return failed_responses[0] if failed_responses else None
+
     def _upload_first_chunk_of_file(self, chunk, url):
         """
         Helper function that takes care of the initial step of the chunked upload process which includes posting the
@@ -91,9 +399,8 @@ class ChunkedUploadMixin(object):
         :param url: the endpoint to which the data should be posted
         :return: outcome of the first chunk uploading process including the upload_id for later referene on further chunks
         """
-        return self.client.request('POST', url, files={
-            'chunk': chunk
-        })
+        payload, headers = self._get_chunk_payload(chunk)
+        return self.client.request('POST', url, headers=headers, **payload)
 
     def _upload_chunk(self, offset, file_size, chunk, chunk_size, url):
         """
@@ -106,19 +413,29 @@ class ChunkedUploadMixin(object):
         :param url: the endpoint to which the data should be posted
         :return: outcome of the chunk uploading process
         """
-        return self.client.request(
-            'PUT', url, files={
-                'chunk': chunk
+        payload, headers = self._get_chunk_payload(chunk)
+        headers.update({
+            'Content-Range': 'bytes %(start)s-%(chunk_size)s/%(file_size)s' % {
+                'start': offset,
+                'chunk_size': offset + chunk_size - 1,
+                'file_size': file_size
             },
-            headers={
-                'Content-Range': 'bytes %(start)s-%(chunk_size)s/%(file_size)s' % {
-                    'start': offset,
-                    'chunk_size': offset + chunk_size - 1,
-                    'file_size': file_size
-                },
-                'Content-Disposition': 'filename="%(file_name)s"' % {'file_name': chunk.name}
-            }
-        )
+            'Content-Disposition': 'filename="%(file_name)s"' % {'file_name': chunk.name}
+        })
+        return self.client.request('PUT', url, headers=headers, **payload)
+
+    @staticmethod
+    def _get_chunk_payload(chunk):
+        """
+        Helper function that builds the body of a request uploading the given chunk. Memory mapped chunks already are
+        a streaming multipart body, any other chunk is sent as regular multipart file upload
+
+        :param chunk: the chunk of the file to be uploaded
+        :return: tuple of the request's keyword arguments carrying the chunk and the headers it requires
+        """
+        if isinstance(chunk, _MultipartChunkBody):
+            return {'data': chunk}, {'Content-Type': chunk.content_type}
+        return {'files': {'chunk': chunk}}, {}
 
     def _commit_chunked_upload(self, md5, url):
         """
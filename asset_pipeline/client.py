@@ -1,6 +1,10 @@
+import hashlib
+import json
 import os
 import sys
 import pickle
+import threading
+import time
 import urllib
 
 
@@ -8,8 +12,10 @@ from oauthlib.oauth2 import LegacyApplicationClient
 from requests_oauthlib import OAuth2Session
 from oauthlib.oauth2.rfc6749 import errors
 
+from http_cache import add_http_cache
 from logger import logger
 from oauthlib_extras.oauth2 import WebApplicationPushClient
+from transport import mount_pooled_adapters
 
 # needed for insecure oauthlib http communication
 # oauth2 is, as per specification, only allowed in
@@ -19,6 +25,49 @@ os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 APPLICATION_STATE_FILE = 'state'
 
 
+class TokenCache(object):
+    """
+    On-disk cache of the oauth token (only readable by
+    the current user), which allows reusing the token
+    after a restart instead of going through the whole
+    authorization grant again.
+
+    The cached token is tied to the identity it has been
+    issued for (server, client and user), so changing any
+    of those invalidates it.
+    """
+    def __init__(self, file_path, *identity):
+        self.file_path = file_path
+        self.identity = hashlib.sha1('\n'.join(str(part) for part in identity)).hexdigest()
+
+    def load(self):
+        """
+        :return: the cached token or None
+        """
+        if not os.path.isfile(self.file_path):
+            return None
+        try:
+            with open(self.file_path) as f:
+                cached = json.load(f)
+        except ValueError:
+            return None
+        if cached.get('identity') != self.identity:
+            return None
+        return cached.get('token')
+
+    def save(self, token):
+        # create the file with restrictive permissions right away, so the token is never readable by others
+        tmp_path = '{0}.tmp'.format(self.file_path)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'identity': self.identity, 'token': token}, f)
+        os.rename(tmp_path, self.file_path)
+
+    def clear(self):
+        if os.path.isfile(self.file_path):
+            os.remove(self.file_path)
+
+
 class ClientConfigParser():
     def __init__(self, config):
         self.config = config
@@ -35,6 +84,19 @@ class ClientConfigParser():
         self.auth_code = config.get('auth_code', os.environ.get('ASSET_PIPELINE_OAUTH_AUTH_CODE'))
         self.username = config.get('username', os.environ.get('ASSET_PIPELINE_OAUTH_USERNAME'))
         self.password = config.get('password', os.environ.get('ASSET_PIPELINE_OAUTH_PASSWORD'))
+        # connection pooling and retries (settings from the config file are strings, so make sure to cast them)
+        self.pool_connections = int(config.get('pool_connections', 10))
+        self.pool_maxsize = int(config.get('pool_maxsize', 10))
+        self.pool_block = str(config.get('pool_block', False)).lower() in ('1', 'true', 'yes', 'on')
+        self.max_retries = int(config.get('max_retries', 3))
+        self.retry_backoff_factor = float(config.get('retry_backoff_factor', 0.5))
+        # refreshing the access token before it expires
+        self.background_token_refresh = str(config.get('background_token_refresh', True)).lower() in (
+            '1', 'true', 'yes', 'on'
+        )
+        self.token_refresh_margin = int(config.get('token_refresh_margin', 60))
+        # file in which to cache the token across restarts (if any)
+        self.token_cache_file = config.get('token_cache_file', os.environ.get('ASSET_PIPELINE_TOKEN_CACHE_FILE'))
         if os.path.isfile(APPLICATION_STATE_FILE):
             with open(APPLICATION_STATE_FILE) as f:
                 self.state = pickle.load(f).get('state', None)
@@ -83,6 +145,14 @@ class ClientConfigParser():
             'username': self.username,
             'password': self.password,
             'base_url': self.base_url,
+            'pool_connections': self.pool_connections,
+            'pool_maxsize': self.pool_maxsize,
+            'pool_block': self.pool_block,
+            'max_retries': self.max_retries,
+            'retry_backoff_factor': self.retry_backoff_factor,
+            'background_token_refresh': self.background_token_refresh,
+            'token_refresh_margin': self.token_refresh_margin,
+            'token_cache_file': self.token_cache_file,
         }
         return kwargs
 
@@ -96,13 +166,30 @@ class ClientFactory():
     it will construct a mail application client (authorization
     code grant), otherwise it wil construct a legacy application
     client (password grant).
+
+    The client's connection pools and retry behaviour can be
+    configured using pool_connections (number of hosts to keep
+    pools for), pool_maxsize (connections per host), pool_block
+    (never exceed pool_maxsize connections per host), max_retries
+    and retry_backoff_factor (for idempotent requests).
+
+    Unless background_token_refresh is disabled, the access token
+    is refreshed token_refresh_margin seconds before it expires.
+
+    If a token_cache_file is given, the token is cached in it and
+    reused (or refreshed) when constructing the next client, so
+    restarts don't need to go through the whole grant again.
     """
     RELATIVE_OAUTH_TOKEN_URL = 'oauth/token/'
     RELATIVE_OAUTH_AUTHORIZATION_URL = 'oauth/authorize/'
+    # creates the timers refreshing the token in the background, called with the delay and the function to call
+    timer_class = staticmethod(threading.Timer)
 
     def __init__(
         self, client_id=None, client_secret=None, base_url=None, auth_code=None, username=None, password=None,
-        state=None, pre_fetch_token=None, rel_token_url=None, rel_auth_url=None
+        state=None, pre_fetch_token=None, rel_token_url=None, rel_auth_url=None, pool_connections=10, pool_maxsize=10,
+        pool_block=False, max_retries=3, retry_backoff_factor=0.5, background_token_refresh=True,
+        token_refresh_margin=60, token_cache_file=None
     ):
         self.client_id = client_id
         self.client_secret = client_secret
@@ -112,6 +199,16 @@ class ClientFactory():
         self.password = password
         self.state = state
         self.pre_fetch_token = pre_fetch_token
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.max_retries = max_retries
+        self.retry_backoff_factor = retry_backoff_factor
+        self.background_token_refresh = background_token_refresh
+        self.token_refresh_margin = token_refresh_margin
+        self.token_cache = TokenCache(
+            token_cache_file, base_url, client_id, username or auth_code
+        ) if token_cache_file else None
         self.token_url = urllib.basejoin(self.base_url, (rel_token_url or self.RELATIVE_OAUTH_TOKEN_URL))
         self.authorization_base_url = urllib.basejoin(
             self.base_url, (rel_auth_url or self.RELATIVE_OAUTH_AUTHORIZATION_URL)
@@ -136,17 +233,18 @@ class ClientFactory():
         :return:
         """
         client = WebApplicationPushClient(client_id=self.client_id, state=self.state)
-        oauth = OAuth2Session(client=client)
+        oauth = self.configure_transport(OAuth2Session(client=client))
         extra_kwargs = {
             'client_id': self.client_id,
             'client_secret': self.client_secret,
         }
         if self.pre_fetch_token:
             self.pre_fetch_token(oauth)
-        oauth.fetch_token(self.token_url, authorization_response=self.auth_code, **extra_kwargs)
         # allows requests_oauthlib to auto refresh expired access tokens
         oauth.auto_refresh_url = self.token_url
         oauth.auto_refresh_kwargs = extra_kwargs
+        if not self.restore_cached_token(oauth):
+            oauth.fetch_token(self.token_url, authorization_response=self.auth_code, **extra_kwargs)
         return oauth
 
     def get_legacy_application_client(self):
@@ -155,19 +253,56 @@ class ClientFactory():
         :return:
         """
         client = LegacyApplicationClient(client_id=self.client_id)
-        oauth = OAuth2Session(client=client)
+        oauth = self.configure_transport(OAuth2Session(client=client))
         extra_kwargs = {
             'client_id': self.client_id,
             'client_secret': self.client_secret
         }
         if self.pre_fetch_token:
             self.pre_fetch_token(oauth)
-        oauth.fetch_token(self.token_url, username=self.username, password=self.password, **extra_kwargs)
         # allows requests_oauthlib to auto refresh expired access tokens
         oauth.auto_refresh_url = self.token_url
         oauth.auto_refresh_kwargs = extra_kwargs
+        if not self.restore_cached_token(oauth):
+            oauth.fetch_token(self.token_url, username=self.username, password=self.password, **extra_kwargs)
         return oauth
 
+    def restore_cached_token(self, oauth):
+        """
+        Restores the cached token (if any) into the oauth
+        session. Expired tokens are refreshed.
+        :param oauth:
+        :return: whether or not the session got a valid token
+        """
+        token = self.token_cache.load() if self.token_cache else None
+        if not token:
+            return False
+        oauth.token = token
+        if token.get('expires_at', 0) > time.time() + self.token_refresh_margin:
+            logger.info('Using cached access token')
+            return True
+        try:
+            oauth.refresh_token(self.token_url)
+            logger.info('Refreshed cached access token')
+            return True
+        except errors.OAuth2Error:
+            # the refresh token is not valid anymore, so we need to go through the whole grant again
+            logger.info('Could not refresh cached access token')
+            self.token_cache.clear()
+            return False
+
+    def configure_transport(self, oauth):
+        """
+        Mounts adapters with the configured connection pool sizes
+        and retry behaviour on the oauth session
+        :param oauth:
+        :return:
+        """
+        return mount_pooled_adapters(
+            oauth, pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, pool_block=self.pool_block,
+            max_retries=self.max_retries, backoff_factor=self.retry_backoff_factor
+        )
+
     def get_authorization_url_and_state(self):
         """
         Constructs an authorization url, which the user can visit
@@ -184,6 +319,10 @@ class ClientFactory():
         refreshes the token (or fetches) on an
         UNAUTHORIZED response, and retries the
         request with the new token.
+
+        If enabled, the token is also refreshed in
+        the background shortly before it expires, so
+        requests hardly ever get rejected at all.
         :param client:
         :return:
         """
@@ -193,8 +332,99 @@ class ClientFactory():
 
         username = self.username
         password = self.password
+        background_token_refresh_enabled = [self.background_token_refresh]
+        token_cache = self.token_cache
+        token_refresh_margin = self.token_refresh_margin
+        timer_class = self.timer_class
+        refresh_timer = []
+        # makes sure only one thread renews the token at a time
+        token_lock = threading.RLock()
+        # counts the renewals of the token, so requests can tell whether the token changed since they were sent
+        token_generation = [0]
+
+        def token_changed():
+            if token_cache:
+                token_cache.save(client.token)
+            schedule_token_refresh()
+
+        def fetch_token():
+            client.fetch_token(
+                client.auto_refresh_url, username=username, password=password, **client.auto_refresh_kwargs
+            )
+            token_changed()
+
+        def refresh_token():
+            try:
+                # we try to refresh the token
+                client.refresh_token(client.auto_refresh_url)
+            except errors.InvalidGrantError:
+                # The hub throws an InvalidGrantError if we can't refresh
+                if isinstance(client._client, LegacyApplicationClient):
+                    # In case it's a password grant type client,
+                    # we just fetch the token again
+                    fetch_token()
+                    return
+                else:
+                    # It's a code grant application, no help here
+                    # nothing can be done
+                    raise
+            token_changed()
+
+        def renew_token(stale_generation, renew):
+            """
+            renews the token using the given function, unless another thread already renewed the stale token
+            while we were waiting for it. This way, concurrent requests which got rejected at the same time
+            only trigger a single refresh and all retry with the new token
+            """
+            with token_lock:
+                if token_generation[0] == stale_generation:
+                    renew()
+                    token_generation[0] += 1
+
+        def refresh_token_in_background():
+            try:
+                renew_token(token_generation[0], refresh_token)
+            except Exception:
+                # not fatal, the token will be renewed once a request gets rejected
+                logger.exception('Could not refresh the access token in the background')
+
+        def schedule_token_refresh():
+            if not background_token_refresh_enabled[0]:
+                return
+            if refresh_timer:
+                refresh_timer.pop().cancel()
+            expires_at = client.token.get('expires_at')
+            if not expires_at:
+                return
+            # tokens living shorter than the margin are refreshed half way through their lifetime
+            expires_in = expires_at - time.time()
+            timer = timer_class(
+                max(expires_in - token_refresh_margin, expires_in / 2, 1), refresh_token_in_background
+            )
+            # don't keep the process alive just to refresh the token
+            timer.daemon = True
+            timer.start()
+            refresh_timer.append(timer)
 
         def request(*args, **kwargs):
+            # streamed request bodies get consumed by sending them, so remember where to rewind them to for a retry
+            data = kwargs.get('data')
+            body_position = data.tell() if hasattr(data, 'tell') and hasattr(data, 'seek') else None
+
+            def retry():
+                if body_position is not None:
+                    data.seek(body_position)
+                return request_func(*args, **kwargs)
+
+            # the generation of the token this request is sent with
+            generation = token_generation[0]
+            expires_at = getattr(client._client, '_expires_at', None)
+            if 'auth' not in kwargs and expires_at and expires_at < time.time():
+                # renew the expired token here rather than in the original request function (requests_oauthlib's
+                # auto refresh), so concurrent requests don't all refresh it at the same time
+                renew_token(generation, refresh_token)
+                generation = token_generation[0]
+
             # the first call on the original request function of the client
             # note: the original request function manages auto refresh if token time expired
             try:
@@ -203,10 +433,8 @@ class ClientFactory():
                 # case when token time expired and requests_oauthlib's auto refresh didn't work
                 # our only option is fetching token (works only for password grant)
                 if isinstance(client._client, LegacyApplicationClient):
-                    client.fetch_token(
-                        client.auto_refresh_url, username=username, password=password, **client.auto_refresh_kwargs
-                    )
-                    res = request_func(*args, **kwargs)
+                    renew_token(generation, fetch_token)
+                    res = retry()
                 else:
                     raise
             if 'auth' in kwargs:
@@ -217,37 +445,35 @@ class ClientFactory():
                 return res
             if res.status_code == UNAUHTORIZED:
                 # expire time valid, but we still got an unauthorized response
-                try:
-                    # we try to refresh the token
-                    client.refresh_token(client.auto_refresh_url)
-                except errors.InvalidGrantError:
-                    # The hub throws an InvalidGrantError if we can't refresh
-                    if isinstance(client._client, LegacyApplicationClient):
-                        # In case it's a password grant type client,
-                        # we just fetch the token again
-                        client.fetch_token(
-                            client.auto_refresh_url, username=username, password=password, **client.auto_refresh_kwargs
-                        )
-                    else:
-                        # It's a code grant application, no help here
-                        # nothing can be done
-                        raise
+                renew_token(generation, refresh_token)
                 # we probably get a new token, so retry
-                res = request_func(*args, **kwargs)
+                res = retry()
             return res
 
-        def token_updater(self):
-            pass
+        def cancel_token_refresh():
+            background_token_refresh_enabled[0] = False
+            if refresh_timer:
+                refresh_timer.pop().cancel()
+
+        def token_updater(token):
+            # requests_oauthlib auto refreshed the expired token
+            token_generation[0] += 1
+            token_changed()
 
         # we change the request function to our new modified version
         client.request = request
         # important, because if we don't specify it, requests_oauthlib raises exceptions to signal update of token
         client.token_updater = token_updater
+        # allows to stop refreshing the token in the background (e.g. when shutting down)
+        client.cancel_token_refresh = cancel_token_refresh
+        # the token has just been fetched (or restored)
+        token_changed()
 
         return client
 
 
-def get_client_for_config(config, rel_token_url=None, rel_auth_url=None, pre_fetch_token=None, state=None):
+def get_client_for_config(config, rel_token_url=None, rel_auth_url=None, pre_fetch_token=None, state=None,
+                          http_cache=None):
     """
     Helper method, which parses the config and returns the
     right client.
@@ -257,6 +483,8 @@ def get_client_for_config(config, rel_token_url=None, rel_auth_url=None, pre_fet
     :param pre_fetch_token: function which does something with the oauth session
     before fetching the token (if needed)
     :param state:
+    :param http_cache: optional ResponseCache, in which case GET requests are
+    revalidated using conditional requests
     :return:
     """
     client_config_parser = ClientConfigParser(config)
@@ -266,6 +494,8 @@ def get_client_for_config(config, rel_token_url=None, rel_auth_url=None, pre_fet
     )
     try:
         client = client_factory.client
+        if http_cache is not None:
+            add_http_cache(client, http_cache)
         return client
     except errors.InvalidClientError:
         logger.info(
@@ -0,0 +1,27 @@
+# use the fastest json implementation available, falling back to the standard library
+try:
+    import ujson as json_backend
+except ImportError:
+    try:
+        import simplejson as json_backend
+    except ImportError:
+        import json as json_backend
+
+
+def decode_message(message):
+    """
+    decodes a (json) message received from the hub
+    :param message:
+    :return:
+    :raises ValueError: if the message is not valid json
+    """
+    return json_backend.loads(message)
+
+
+def encode_message(msg):
+    """
+    encodes a message to be sent to the hub as json
+    :param msg:
+    :return:
+    """
+    return json_backend.dumps(msg)
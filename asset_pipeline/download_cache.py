@@ -0,0 +1,110 @@
+import hashlib
+import os
+import threading
+from os import path
+
+from logger import logger
+from materialize import materialize_file
+
+
+class DownloadCache(object):
+    """
+    content-addressed cache of downloaded files shared by all jobs of a pipeline.
+
+    files are keyed by their url and the validator (ETag or checksum) the server sent along with them, so a file
+    that changed on the server is never served from the cache. Cached files are reflinked (or copied) into the jobs'
+    folders, never hardlinked, so jobs may modify their files. The least recently used files are evicted once the
+    cache grows beyond max_size bytes
+    """
+    def __init__(self, root, max_size):
+        self.root = root
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # the validator of the most recently cached version of every url
+        self.validators = {}
+        if not path.exists(self.root):
+            os.makedirs(self.root)
+
+    @staticmethod
+    def get_key(url, validator):
+        return hashlib.sha1('{0}\n{1}'.format(url, validator)).hexdigest()
+
+    def get_path(self, url, validator):
+        return path.join(self.root, self.get_key(url, validator))
+
+    def get_validator(self, url):
+        """
+        returns the validator of the most recently cached version of url, if it's still cached
+        :param url:
+        :return:
+        """
+        validator = self.validators.get(url)
+        if validator and path.isfile(self.get_path(url, validator)):
+            return validator
+        return None
+
+    def get_etag(self, url):
+        """
+        returns the ETag of the most recently cached version of url (if it's cached and has been identified by an
+        ETag), which allows to download it using a conditional request
+        :param url:
+        :return:
+        """
+        validator = self.get_validator(url)
+        # strong ETags are quoted, unlike checksums
+        if validator and validator.startswith('"'):
+            return validator
+        return None
+
+    def get(self, url, validator, target_path):
+        """
+        provides the cached file for url and validator at target_path
+        :param url: the url the file has been downloaded from
+        :param validator: the ETag or checksum of the file
+        :param target_path: the path at which the file should be provided
+        :return: whether or not the file was cached
+        """
+        cache_path = self.get_path(url, validator)
+        with self.lock:
+            if not path.isfile(cache_path):
+                return False
+            # mark the file as recently used
+            os.utime(cache_path, None)
+            materialize_file(cache_path, target_path, allow_hardlink=False)
+            self.validators[url] = validator
+        logger.debug('Using cached download of %s' % url)
+        return True
+
+    def put(self, url, validator, source_path):
+        """
+        adds the file at source_path, which has been downloaded from url, to the cache
+        :param url: the url the file has been downloaded from
+        :param validator: the ETag or checksum of the file
+        :param source_path: the path of the downloaded file
+        :return:
+        """
+        cache_path = self.get_path(url, validator)
+        with self.lock:
+            # copy to a temporary name first, so other jobs never see a partially copied file. The cached file must
+            # not be a hardlink of the job's file, which the job may still modify
+            tmp_path = '{0}.tmp'.format(cache_path)
+            materialize_file(source_path, tmp_path, allow_hardlink=False)
+            os.rename(tmp_path, cache_path)
+            self.validators[url] = validator
+            self._evict()
+
+    def _evict(self):
+        """
+        removes the least recently used files until the cache fits into max_size again
+        """
+        entries = []
+        for name in os.listdir(self.root):
+            stat = os.stat(path.join(self.root, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            logger.debug('Evicting %s from the download cache' % name)
+            os.remove(path.join(self.root, name))
+            size -= entry_size
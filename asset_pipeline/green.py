@@ -0,0 +1,59 @@
+try:
+    import gevent.monkey
+    from gevent.pool import Pool
+    from gevent.threadpool import ThreadPool
+except ImportError:
+    gevent = None
+
+from logger import logger
+from pipeline import BaseRemoteAssetPipeline
+
+
+class GreenRemoteAssetPipeline(BaseRemoteAssetPipeline):
+    """
+    remote asset pipeline which runs every conversion job in a greenlet instead of a thread of its own, so a single
+    process can multiplex hundreds of I/O-bound jobs.
+
+    requires gevent (pip install hub-asset-pipeline[gevent]) and the standard library to be monkey patched before
+    anything else is imported, i.e. the command line script has to start with
+
+        from gevent import monkey
+        monkey.patch_all()
+
+    websocket, downloads, uploads and api requests as well as the pre_execute and post_execute hooks then yield to
+    the other jobs whenever they wait for the network. execute stays plain synchronous code, which is run in a pool
+    of real threads so CPU-bound conversions don't block the other jobs
+    """
+    # greenlets are cheap, so many more jobs can be processed at the same time
+    max_concurrent_jobs = 100
+    # number of threads in which the execute step of the jobs is run
+    max_concurrent_executions = 4
+    # pool of threads in which the execute step of the jobs is run
+    execution_pool = None
+
+    def __init__(self, config=None, *args, **kwargs):
+        if gevent is None:
+            raise ImportError('{0} requires gevent, please install it using '
+                              'pip install hub-asset-pipeline[gevent]'.format(self.__class__.__name__))
+        if not gevent.monkey.is_module_patched('socket'):
+            logger.warn('The socket module has not been monkey patched by gevent, '
+                        'jobs will block each other while waiting for the network')
+        # settings from the config file are strings, so make sure to cast them
+        if config and config.get('max_concurrent_executions') is not None:
+            self.max_concurrent_executions = int(config['max_concurrent_executions'])
+        self.execution_pool = ThreadPool(self.max_concurrent_executions)
+        # call parent constructor (taking care of config validation and creating the job pool)
+        super(GreenRemoteAssetPipeline, self).__init__(config=config, *args, **kwargs)
+
+    def create_job_pool(self):
+        # jobs submitted to a full pool (using apply_async) wait in a greenlet of their own, so the websocket keeps
+        # receiving messages
+        return Pool(self.max_concurrent_jobs)
+
+    def dispatch_execute(self, asset_data):
+        """
+        runs the (synchronous) execute step in the execution pool, only blocking the job's greenlet meanwhile
+        :param asset_data:
+        :return:
+        """
+        return self.execution_pool.apply(super(GreenRemoteAssetPipeline, self).dispatch_execute, (asset_data,))
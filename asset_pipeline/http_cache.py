@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+
+from logger import logger
+
+
+class ResponseCache(object):
+    """
+    bounded in-memory cache of responses to GET requests, kept along with their validators (ETag / Last-Modified)
+    so they can be revalidated with conditional requests. Once more than max_entries responses are cached, the least
+    recently used ones are dropped
+    """
+    def __init__(self, max_entries=128, max_body_size=1 << 20):
+        self.max_entries = max_entries
+        # responses with larger bodies are not worth keeping in memory
+        self.max_body_size = max_body_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        with self.lock:
+            response = self.entries.pop(url, None)
+            if response is not None:
+                # mark the response as recently used
+                self.entries[url] = response
+            return response
+
+    def put(self, url, response):
+        if len(response.content) > self.max_body_size:
+            return
+        with self.lock:
+            self.entries.pop(url, None)
+            self.entries[url] = response
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def add_http_cache(client, cache):
+    """
+    changes the client's request function, so GET requests for resources which have been retrieved before are sent
+    as conditional requests (using If-None-Match / If-Modified-Since). If the server answers with 304 Not Modified,
+    the cached response is returned instead.
+
+    streamed requests are never cached, their bodies could be arbitrarily large
+    :param client: the (authenticated) client
+    :param cache: the ResponseCache to store the responses in
+    :return:
+    """
+    # we need to backup the original request function
+    request_func = client.request
+    NOT_MODIFIED = 304
+
+    def request(method, url, *args, **kwargs):
+        if method.upper() != 'GET' or args or kwargs.get('stream') or kwargs.get('params'):
+            return request_func(method, url, *args, **kwargs)
+        headers = dict(kwargs.pop('headers', None) or {})
+        # the caller might want to validate the resource on its own
+        conditional = 'If-None-Match' in headers or 'If-Modified-Since' in headers
+        cached_response = cache.get(url) if not conditional else None
+        if cached_response is not None:
+            if cached_response.headers.get('ETag'):
+                headers['If-None-Match'] = cached_response.headers['ETag']
+            if cached_response.headers.get('Last-Modified'):
+                headers['If-Modified-Since'] = cached_response.headers['Last-Modified']
+        response = request_func(method, url, headers=headers, **kwargs)
+        if response.status_code == NOT_MODIFIED and cached_response is not None:
+            logger.debug('%s has not been modified, using the cached response' % url)
+            return cached_response
+        if response.status_code == 200 and not conditional and \
+                (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+            cache.put(url, response)
+        return response
+
+    # we change the request function to our new modified version
+    client.request = request
+    return client
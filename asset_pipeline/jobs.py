@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _RunningJob(object):
+    def __init__(self):
+        # the AsyncResult (or StagedJob) of the job, once it has been submitted
+        self.handle = None
+
+
+class JobRegistry(object):
+    """
+    keeps track of the jobs which are running and of the results of the ones which finished recently (within
+    finished_ttl seconds), so a job which is requested again is neither run twice at the same time nor right again
+    after it finished
+    """
+    def __init__(self, finished_ttl=60):
+        self.finished_ttl = finished_ttl
+        self.running = {}
+        # the results of recently finished jobs, in the order in which they finished
+        self.finished = OrderedDict()
+        self.lock = threading.Lock()
+
+    def start(self, key):
+        """
+        registers a running job
+        :param key:
+        :return: a tuple of the job's entry and whether it has just been registered (False if the job is running
+        already)
+        """
+        with self.lock:
+            if key in self.running:
+                return self.running[key], False
+            self.running[key] = entry = _RunningJob()
+            self.finished.pop(key, None)
+            return entry, True
+
+    def get_running(self, key):
+        """
+        returns the entry of the job if it's running, None otherwise
+        :param key:
+        :return:
+        """
+        with self.lock:
+            return self.running.get(key)
+
+    def finish(self, key, result=None):
+        """
+        marks the job as not running anymore and remembers its result
+        :param key:
+        :param result: the result (e.g. the message reporting it), None if it shouldn't be remembered (so the job may
+        be run again right away)
+        :return:
+        """
+        with self.lock:
+            self.running.pop(key, None)
+            self.finished.pop(key, None)
+            if result is not None:
+                self.finished[key] = (time.time(), result)
+            self._expire()
+
+    def get_finished(self, key):
+        """
+        returns the result of the job, if it finished within the last finished_ttl seconds
+        :param key:
+        :return:
+        """
+        with self.lock:
+            self._expire()
+            entry = self.finished.get(key)
+            return entry[1] if entry is not None else None
+
+    def _expire(self):
+        expired_before = time.time() - self.finished_ttl
+        while self.finished:
+            key, (finished_at, _) = next(self.finished.iteritems())
+            if finished_at >= expired_before:
+                break
+            del self.finished[key]
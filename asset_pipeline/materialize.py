@@ -0,0 +1,97 @@
+import errno
+import os
+import shutil
+from os import path
+
+try:
+    import fcntl
+except ImportError:
+    # not available on windows
+    fcntl = None
+
+from logger import logger
+
+# linux ioctl cloning a file's extents into another one (copy-on-write), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+REFLINK = 'reflink'
+HARDLINK = 'hardlink'
+COPY = 'copy'
+
+
+def reflink(source_path, target_path):
+    """
+    creates target_path as a copy-on-write clone of source_path, which shares the source's data blocks until
+    either of them is modified (supported e.g. by btrfs, xfs and overlayfs on top of them)
+    :param source_path:
+    :param target_path:
+    :return: whether or not the file could be cloned
+    """
+    if fcntl is None:
+        return False
+    with open(source_path, 'rb') as source:
+        with open(target_path, 'wb') as target:
+            try:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+                return True
+            except (IOError, OSError) as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+                    raise
+    os.remove(target_path)
+    return False
+
+
+def materialize_file(source_path, target_path, allow_hardlink=False, buffer_size=1 << 20):
+    """
+    provides the file at source_path at target_path (replacing any file there) without copying its content if
+    possible, trying (in this order) to
+    - reflink it (independent copy sharing the data blocks)
+    - hardlink it, only if allowed (same file, so neither of them must be modified in place afterwards)
+    - copy it in chunks of buffer_size bytes
+    :param source_path:
+    :param target_path:
+    :param allow_hardlink: whether or not the file may be hardlinked
+    :param buffer_size:
+    :return: the method used (REFLINK, HARDLINK or COPY)
+    """
+    if path.lexists(target_path):
+        os.remove(target_path)
+    if reflink(source_path, target_path):
+        method = REFLINK
+    else:
+        method = COPY
+        if allow_hardlink:
+            try:
+                os.link(source_path, target_path)
+                method = HARDLINK
+            except OSError:
+                # e.g. because they're located on different filesystems
+                pass
+        if method == COPY:
+            with open(source_path, 'rb') as source:
+                with open(target_path, 'wb') as target:
+                    shutil.copyfileobj(source, target, buffer_size)
+    if method != HARDLINK:
+        shutil.copymode(source_path, target_path)
+    return method
+
+
+def materialize_tree(source_folder, target_folder, allow_hardlink=False):
+    """
+    provides all files inside of source_folder (recursively) at target_folder using materialize_file, so the cost
+    depends on the number of files rather than their size where possible
+    :param source_folder:
+    :param target_folder:
+    :param allow_hardlink: whether or not the files may be hardlinked
+    :return: the number of files materialized per method
+    """
+    methods = {}
+    for root, _, names in os.walk(source_folder):
+        target_root = path.join(target_folder, path.relpath(root, source_folder))
+        if not path.exists(target_root):
+            os.makedirs(target_root)
+        for name in names:
+            method = materialize_file(path.join(root, name), path.join(target_root, name), allow_hardlink)
+            methods[method] = methods.get(method, 0) + 1
+    logger.debug('Materialized %s at %s: %s' % (source_folder, target_folder, methods))
+    return methods
@@ -1,15 +1,75 @@
 # coding=utf-8
-import json
+import copy
+import inspect
+import os
+import random
 import shutil
+import threading
 import urllib
-from distutils.dir_util import copy_tree
+from multiprocessing import Pool, Queue
+from multiprocessing.pool import ThreadPool
 from os import makedirs
 
+import requests
 import websocket
 
 from logger import logger
 from protocol import *
 from client import get_client_for_config
+from codec import decode_message, encode_message
+from download_cache import DownloadCache
+from http_cache import ResponseCache
+from jobs import JobRegistry
+from materialize import materialize_file, materialize_tree
+from progress import ProgressReporter, TransferProgress
+from result_cache import OPERATIONAL_SETTINGS, ResultCache, apply_changes, get_changes
+from scheduler import StagedScheduler
+from streaming import InputStream
+from transport import get_pool_statistics
+from working_directories import WorkingDirectoryManager
+
+
+def get_free_disk_space(folder):
+    """
+    returns the number of bytes available to the current user on the filesystem of the given folder (or of its
+    closest existing parent folder)
+    :param folder:
+    :return:
+    """
+    folder = path.abspath(folder)
+    while not path.exists(folder) and path.dirname(folder) != folder:
+        folder = path.dirname(folder)
+    stat = os.statvfs(folder)
+    return stat.f_bavail * stat.f_frsize
+
+
+# the pipeline whose execute step is run by the current worker process (see AbstractAssetPipeline.execute_processes)
+_process_pipeline = None
+# queue on which the current worker process hands the progress it reports to the parent process
+_process_progress_queue = None
+
+
+def _init_execute_process(pipeline, progress_queue):
+    """
+    initializes a worker process of the execute pool. The pipeline and the queue are handed over when the process is
+    forked, so they never need to be pickled
+    :param pipeline:
+    :param progress_queue:
+    :return:
+    """
+    global _process_pipeline, _process_progress_queue
+    _process_pipeline = pipeline
+    _process_progress_queue = progress_queue
+
+
+def _execute_in_process(asset_data):
+    """
+    runs the execute step of the worker process' pipeline for the given asset
+    :param asset_data:
+    :return: the (possibly modified) asset_data, so it can be sent back to the parent process
+    """
+    result = _process_pipeline.execute(asset_data)
+    return result if isinstance(result, dict) else asset_data
 
 
 class AbstractAssetPipeline(object):
@@ -22,6 +82,24 @@ class AbstractAssetPipeline(object):
     # asset pipeline configuration provided as a dictionary
     config = None
 
+    # number of worker processes in which the (CPU-bound) execute step is run, so conversions aren't serialized by
+    # the GIL. 0 runs execute in the same process as the pre_execute and post_execute hooks
+    execute_processes = 0
+    # pool of worker processes running the execute step (if enabled)
+    execute_pool = None
+    # queue on which the worker processes hand the progress they report to the pipeline's process
+    execute_progress_queue = None
+
+    # version of the pipeline's conversion, to be increased whenever it changes its output (so results cached by
+    # an earlier version are not used anymore)
+    version = None
+    # maximum size in bytes of the cache of conversion results (0 disables caching results)
+    result_cache_size = 0
+    # folder in which conversion results are cached
+    result_cache_path = path.join(TMP_FILES_PATH, 'result_cache')
+    # cache of conversion results (if enabled)
+    result_cache = None
+
     def __init__(self, config=None, *args, **kwargs):
         """
         public constructor / main initialization method
@@ -33,6 +111,15 @@ class AbstractAssetPipeline(object):
                 self.config = config
             else:
                 raise AttributeError('The provided configuration could not be validated. Please verify!')
+            # settings from the config file are strings, so make sure to cast them
+            for setting in ('execute_processes', 'result_cache_size'):
+                if config.get(setting) is not None:
+                    setattr(self, setting, int(config[setting]))
+            if config.get('result_cache_path'):
+                self.result_cache_path = config['result_cache_path']
+        if self.result_cache_size > 0:
+            self.result_cache = ResultCache(self.result_cache_path, self.result_cache_size)
+        self.execute_pool_lock = threading.Lock()
 
     def validate_configuration(self, config):
         """
@@ -51,9 +138,119 @@ class AbstractAssetPipeline(object):
         :return:
         """
         self.pre_execute(asset_data)
-        self.execute(asset_data)
+        self.dispatch_execute(asset_data)
         self.post_execute(asset_data)
 
+    def dispatch_execute(self, asset_data):
+        """
+        runs the execute step for the given asset. Subclasses may override this in order to have execute run
+        somewhere else (e.g. in a pool of threads or processes)
+
+        if execute_processes is set, execute is run in one of the worker processes and any changes it made to
+        asset_data are merged back into it afterwards.
+
+        if the result cache is enabled and the asset's input file has been converted with the same settings before,
+        the cached output (and the changes execute made to asset_data) is restored instead of running execute
+        :param asset_data:
+        :return:
+        """
+        key = self.get_result_cache_key(asset_data)
+        if key is not None:
+            changes = self.result_cache.restore(key, asset_data['output']['path'])
+            if changes is not None:
+                # the later steps may rely on what execute stored in asset_data
+                apply_changes(asset_data, changes)
+                logger.info('Restored cached conversion result for asset_data %s' % asset_data)
+                return asset_data
+            original_asset_data = copy.deepcopy(asset_data)
+        if self.execute_processes <= 0:
+            result = self.execute(asset_data)
+        else:
+            result = asset_data
+            asset_data.update(self.get_execute_pool().apply(_execute_in_process, (asset_data,)))
+        if key is not None:
+            self.result_cache.store(
+                key, asset_data['output']['path'], get_changes(original_asset_data, asset_data)
+            )
+        return result
+
+    def get_result_cache_settings(self):
+        """
+        returns the settings which affect the outcome of a conversion, so results converted with different ones are
+        cached separately. Defaults to the whole configuration, except for the settings concerning the connection,
+        authentication and the way jobs are run
+        :return:
+        """
+        return dict(
+            (key, value) for key, value in (self.config or {}).items() if key not in OPERATIONAL_SETTINGS
+        )
+
+    def get_result_cache_key(self, asset_data):
+        """
+        identifies the conversion result of the given asset by its input file's content, the pipeline (class and
+        version) and the relevant settings
+        :param asset_data:
+        :return: the key, or None if results are not cached (or the asset has no input file or output folder)
+        """
+        if self.result_cache is None:
+            return None
+        input_path = (asset_data.get('input') or {}).get('path')
+        output_path = (asset_data.get('output') or {}).get('path')
+        if not input_path or not output_path or not path.isfile(input_path):
+            return None
+        pipeline = '{0}.{1}:{2}'.format(self.__class__.__module__, self.__class__.__name__, self.version)
+        return self.result_cache.get_key(input_path, pipeline, self.get_result_cache_settings())
+
+    def get_execute_pool(self):
+        """
+        returns the pool of worker processes running the execute step, starting it if necessary. The workers are
+        forked from the current process (so they inherit the pipeline as it is right now) and reused for all jobs.
+        Forked processes only inherit the thread forking them (along with any locks held by the other threads), so
+        the pool should be started while no other threads are busy
+        :return:
+        """
+        with self.execute_pool_lock:
+            if self.execute_pool is None:
+                logger.info('Starting %s processes to execute the pipeline in' % self.execute_processes)
+                self.execute_progress_queue = Queue()
+                self.execute_pool = Pool(
+                    processes=self.execute_processes, initializer=_init_execute_process,
+                    initargs=(self, self.execute_progress_queue)
+                )
+                relay = threading.Thread(
+                    target=self._relay_execute_progress, args=(self.execute_progress_queue,),
+                    name='execute-progress-relay'
+                )
+                relay.daemon = True
+                relay.start()
+            return self.execute_pool
+
+    def _relay_execute_progress(self, progress_queue):
+        """
+        reports the progress reported by the worker processes (until the pool is closed)
+        :param progress_queue:
+        :return:
+        """
+        for job_id, progress, stage in iter(progress_queue.get, None):
+            try:
+                self.report_progress({'id': job_id}, progress, stage)
+            except Exception:
+                logger.exception('Could not report progress of job %s' % job_id)
+
+    def close_execute_pool(self):
+        """
+        lets the worker processes running the execute step exit once they're done with their current jobs
+        :return:
+        """
+        with self.execute_pool_lock:
+            if self.execute_pool is not None:
+                self.execute_pool.close()
+                self.execute_pool.join()
+                self.execute_pool = None
+                # stops relaying the progress
+                self.execute_progress_queue.put(None)
+                self.execute_progress_queue = None
+
     def execute(self, asset_data):
         """
         converts the given input file to be compatible with the specified platform
@@ -78,6 +275,33 @@ class AbstractAssetPipeline(object):
         """
         raise NotImplementedError('Subclasses of the AbstractAssetPipeline must implement the post_execute method')
 
+    def report_progress(self, asset_data, progress, stage=None):
+        """
+        reports the progress of the job converting the given asset. May be called as often as needed, the
+        pipeline takes care of throttling the updates
+        :param asset_data:
+        :param progress: the job's progress, between 0 and 1
+        :param stage: the part of the job which is running (e.g. 'download', 'execute' or 'upload')
+        :return:
+        """
+        pass
+
+    def materialize(self, source_path, target_path, allow_hardlink=False):
+        """
+        provides the file or folder at source_path at target_path without copying the files' contents if possible
+        (by reflinking them), so passing files through costs O(files) rather than O(bytes) where supported.
+        Files may be hardlinked as well if allowed, but hardlinked files are the very same files, so they must not
+        be modified in place afterwards
+        :param source_path: file or folder (which is materialized recursively)
+        :param target_path:
+        :param allow_hardlink: whether or not files may be hardlinked
+        :return:
+        """
+        if path.isdir(source_path):
+            materialize_tree(source_path, target_path, allow_hardlink)
+        else:
+            materialize_file(source_path, target_path, allow_hardlink)
+
     def supports(self, asset_data):
         """
         simple method to check whether this pipeline supports the given file
@@ -110,6 +334,65 @@ class BaseRemoteAssetPipeline(AbstractAssetPipeline):
     connect_path = 'ws/assets/pipeline/'
     # dictionary of additional headers to be included in an connection attempt
     additional_headers = {}
+    # maximum number of conversion jobs to be processed at the same time
+    max_concurrent_jobs = 1
+    # pool of workers running the conversion jobs (so they don't block the websocket connection)
+    job_pool = None
+    # size of the buffer through which downloaded files are written to disk
+    download_buffer_size = 1 << 20
+    # number of byte ranges of a file to be downloaded at the same time (if the server supports range requests)
+    parallel_downloads = 1
+    # files smaller than this are always downloaded in one piece
+    parallel_download_min_size = 32 << 20
+    # maximum size in bytes of the cache of downloaded files shared by all jobs (0 disables caching downloads)
+    download_cache_size = 0
+    # whether or not the pipeline converts its input while it's being downloaded (see execute_stream)
+    supports_streaming_input = False
+    # whether or not streamed input is written to disk as well, e.g. because the pipeline needs the file later on
+    stream_input_to_disk = False
+    # folder in which the jobs' working directories are created (e.g. on a tmpfs or fast local disk)
+    working_directory_path = TMP_FILES_PATH
+    # maximum size in bytes of all working directories, the directories of finished jobs are removed to stay within
+    # it (0 keeps all of them)
+    working_directory_budget = 0
+    # maximum number of seconds a job waits for space for its working directory
+    working_directory_timeout = 60.0
+    # folder in which downloaded files are cached (should be on the same filesystem as TMP_FILES_PATH, so cached
+    # files can be reflinked)
+    download_cache_path = path.join(TMP_FILES_PATH, 'download_cache')
+    # cache of downloaded files (if enabled)
+    download_cache = None
+    # maximum number of responses to api requests kept for revalidating them with conditional requests
+    # (0 disables caching responses)
+    http_cache_size = 0
+    # whether to run the jobs' pre_execute (download), execute (convert) and post_execute (upload) steps in separate
+    # stages, so the steps of different jobs overlap
+    staged_jobs = False
+    # number of workers per stage
+    pre_execute_workers = 1
+    execute_workers = 1
+    post_execute_workers = 1
+    # number of jobs which may wait in between two stages
+    stage_queue_size = 1
+    # scheduler running the stages (if enabled)
+    scheduler = None
+    # minimum number of seconds in between two progress updates sent for the same job
+    progress_interval = 1.0
+    # maximum number of jobs waiting for a free worker, any further jobs are rejected (None doesn't limit them)
+    max_queued_jobs = None
+    # handlers of the messages received from the hub by their type, either the name of a method of the pipeline or a
+    # function taking the message. Messages of any other type are ignored
+    message_handlers = {
+        MessageType.CONVERSION_START: 'on_conversion_start',
+    }
+    # number of seconds for which the results of finished jobs are remembered, so the job is not run again if it's
+    # requested again within this time (e.g. after a reconnect)
+    finished_jobs_ttl = 60.0
+    # whether or not to reconnect once the connection to the hub is lost
+    reconnect = True
+    # bounds of the (exponentially growing and jittered) delay in between two connection attempts, in seconds
+    reconnect_min_delay = 1.0
+    reconnect_max_delay = 60.0
 
     def __init__(self, config=None, *args, **kwargs):
         # call parent constructor (taking care of config validation)
@@ -120,10 +403,74 @@ class BaseRemoteAssetPipeline(AbstractAssetPipeline):
         self.ssl = config['ssl']
         if self.ssl:
             self.protocol = self.protocol + 's'
+        # settings from the config file are strings, so make sure to cast them
+        for setting in ('max_concurrent_jobs', 'download_buffer_size', 'parallel_downloads',
+                        'parallel_download_min_size', 'download_cache_size', 'http_cache_size',
+                        'pre_execute_workers', 'execute_workers', 'post_execute_workers', 'stage_queue_size',
+                        'working_directory_budget'):
+            if config.get(setting) is not None:
+                setattr(self, setting, int(config[setting]))
+        if config.get('max_queued_jobs') is not None:
+            self.max_queued_jobs = int(config['max_queued_jobs'])
+        for setting in ('progress_interval', 'reconnect_min_delay', 'reconnect_max_delay', 'finished_jobs_ttl',
+                        'working_directory_timeout'):
+            if config.get(setting) is not None:
+                setattr(self, setting, float(config[setting]))
+        if config.get('reconnect') is not None:
+            self.reconnect = str(config['reconnect']).lower() in ('1', 'true', 'yes', 'on')
+        if config.get('stream_input_to_disk') is not None:
+            self.stream_input_to_disk = str(config['stream_input_to_disk']).lower() in ('1', 'true', 'yes', 'on')
+        if config.get('staged_jobs') is not None:
+            self.staged_jobs = str(config['staged_jobs']).lower() in ('1', 'true', 'yes', 'on')
+        if config.get('download_cache_path'):
+            self.download_cache_path = config['download_cache_path']
+        if config.get('working_directory_path'):
+            self.working_directory_path = config['working_directory_path']
+        self.working_directories = WorkingDirectoryManager(
+            self.working_directory_path, self.working_directory_budget, self.working_directory_timeout
+        )
+        if self.download_cache_size > 0:
+            self.download_cache = DownloadCache(self.download_cache_path, self.download_cache_size)
         # authenticated client
-        self.client = get_client_for_config(config)
+        self.client = self.create_client(config)
+        # handlers may be registered per instance as well
+        self.message_handlers = dict(self.message_handlers)
+        # whether or not the websocket connection is established right now
+        self.connected = False
+        # number of times the websocket connection has been established
+        self.connections = 0
+        # set once the pipeline is being stopped (so it won't reconnect)
+        self.stopping = threading.Event()
+        # messages which could not be sent while disconnected
+        self.outbox = []
+        self.outbox_lock = threading.Lock()
+        # running and recently finished jobs
+        self.job_registry = JobRegistry(self.finished_jobs_ttl)
+        # number of jobs which have been submitted, but are not done yet
+        self.active_jobs = 0
+        self.active_jobs_lock = threading.Lock()
+        self.progress_reporter = ProgressReporter(self.send_progress, self.progress_interval)
+        # workers to run the conversion jobs in
+        if self.staged_jobs:
+            self.scheduler = StagedScheduler([
+                ('pre_execute', self.pre_execute, self.pre_execute_workers),
+                ('execute', self.dispatch_execute, self.execute_workers),
+                ('post_execute', self.post_execute, self.post_execute_workers),
+            ], queue_size=self.stage_queue_size, on_done=self.on_job_done)
+        else:
+            self.job_pool = self.create_job_pool()
         logger.info('Running based on %s' % self)
 
+    def create_client(self, config):
+        """
+        creates the authenticated client through which the hub's api is accessed
+        :param config:
+        :return:
+        """
+        return get_client_for_config(
+            config, http_cache=ResponseCache(self.http_cache_size) if self.http_cache_size > 0 else None
+        )
+
     def validate_configuration(self, config):
         # make sure hostname and port are set
         NOT_PROVIDED_ERROR_MSG = '{0} needs to be provided in order to connect the pipeline to the hub'
@@ -136,6 +483,13 @@ class BaseRemoteAssetPipeline(AbstractAssetPipeline):
         # if we got here, everything's fine
         return True
 
+    def get_connection_pool_statistics(self):
+        """
+        statistics about the client's connection pools (per host), e.g. to find out whether they are exhausted
+        :return:
+        """
+        return get_pool_statistics(self.client)
+
     def add_authentication_to_headers(self, headers):
         """
         Adds valid authorization header to the passed header dict
@@ -144,22 +498,30 @@ class BaseRemoteAssetPipeline(AbstractAssetPipeline):
         headers['Authorization'] = 'Bearer {0}'.format(access_token)
         return headers
 
-    @staticmethod
-    def on_socket_open(socket):
+    def on_socket_open(self, socket):
         """
         open / connect handler for websocket connection
         :param socket: the newly opened websocket instance
         :return:
         """
         logger.info('Successfully connected to Innoactive® Hub!')
+        self.connected = True
+        self.connections += 1
+        # report the results of the jobs which were done while we were disconnected
+        with self.outbox_lock:
+            outbox, self.outbox = self.outbox, []
+        for msg_type, data in outbox:
+            self.send_message(msg_type, data, buffer=True)
+        # let the hub know how many jobs we can take
+        self.send_capacity()
 
-    @staticmethod
-    def on_socket_close(socket):
+    def on_socket_close(self, socket):
         """
         close handler for open websocket connection
         :param socket: the websocket instance which was closed
         :return:
         """
+        self.connected = False
         logger.info('Connection to Innoactive® Hub closed')
 
     @staticmethod
@@ -175,29 +537,269 @@ class BaseRemoteAssetPipeline(AbstractAssetPipeline):
 
     def on_socket_message(self, socket, message):
         """
-        message handler for open websocket connection
+        message handler for open websocket connection. The hub may batch messages by sending a list of them
         :param socket: the websocket instance on which a message was received
         :param message:
         :return:
         """
         # the message should be json, try to parse it now
-        msg = json.loads(message)
+        try:
+            msg = self.decode_message(message)
+        except ValueError:
+            logger.warn('Could not decode message: \n%s' % message)
+            return
+        for msg in (msg if isinstance(msg, list) else [msg]):
+            self.dispatch_message(msg)
+
+    def decode_message(self, message):
+        """
+        decodes a message received from the hub
+        :param message:
+        :return:
+        """
+        return decode_message(message)
+
+    def register_message_handler(self, msg_type, handler):
+        """
+        registers the function handling the messages of the given type
+        :param msg_type:
+        :param handler: function taking the (decoded) message
+        :return:
+        """
+        self.message_handlers[msg_type] = handler
+
+    def dispatch_message(self, msg):
+        """
+        hands the (decoded) message over to the handler registered for its type
+        :param msg:
+        :return:
+        """
         # check if a message type is included
-        if isinstance(msg, dict):
-            # check what kind of message we got
-            if 'type' in msg:
-                msg_type = msg.get('type')
-                if msg_type == MessageType.CONVERSION_START:
-                    # the msg needs to contain some data in order to execute anything
-                    if 'data' in msg:
-                        asset_data = msg.get('data')
-                        logger.info('Starting to run pipeline... Model data is %s' % asset_data)
-                        if self.supports(asset_data):
-                            self.run(asset_data)
-                        else:
-                            logger.info("Could not handle provided asset %s" % asset_data)
-                    else:
-                        logger.warn('Should start converting, but data is missing from message: \n%s' % message)
+        if not isinstance(msg, dict) or 'type' not in msg:
+            logger.debug('Ignoring message without a type: %s' % msg)
+            return
+        handler = self.message_handlers.get(msg['type'])
+        if handler is None:
+            logger.debug('Ignoring message of type %s' % msg['type'])
+            return
+        if isinstance(handler, basestring):
+            handler = getattr(self, handler)
+        handler(msg)
+
+    def on_conversion_start(self, msg):
+        """
+        handles CONVERSION_START messages by submitting a job for the asset, if it's supported
+        :param msg:
+        :return:
+        """
+        # the msg needs to contain some data in order to execute anything
+        if 'data' not in msg:
+            logger.warn('Should start converting, but data is missing from message: \n%s' % msg)
+            return
+        asset_data = msg.get('data')
+        logger.info('Starting to run pipeline... Model data is %s' % asset_data)
+        if not self.supports(asset_data):
+            logger.info("Could not handle provided asset %s" % asset_data)
+        elif self.handle_duplicate_job(asset_data):
+            return
+        elif not self.has_capacity((asset_data.get('upload') or {}).get('size') or 0):
+            logger.warn('Rejecting asset %s, the pipeline is running at capacity' % asset_data.get('id'))
+            self.send_message(MessageType.CONVERSION_REJECTED, {
+                'id': asset_data.get('id'), 'capacity': self.get_capacity()
+            })
+        else:
+            self.submit_job(asset_data)
+
+    def create_job_pool(self):
+        """
+        creates the pool of workers in which the conversion jobs are run
+        :return:
+        """
+        return ThreadPool(processes=self.max_concurrent_jobs)
+
+    def submit_job(self, asset_data):
+        """
+        hands the given asset over to the job pool, so it is converted in the background. At most
+        max_concurrent_jobs are run at the same time, any further jobs wait for a free worker.
+
+        if staged_jobs is enabled, the asset is handed over to the scheduler instead, which runs it through the
+        pre_execute, execute and post_execute stages (bypassing run)
+        if a job for the same asset is running already, no new job is started
+        :param asset_data: all available data about the asset to be converted
+        :return: the AsyncResult (or StagedJob) of the scheduled job
+        """
+        entry, started = self.job_registry.start(self.get_job_key(asset_data))
+        if not started:
+            return entry.handle
+        with self.active_jobs_lock:
+            self.active_jobs += 1
+        if self.scheduler is not None:
+            entry.handle = self.scheduler.submit(asset_data)
+        else:
+            entry.handle = self.job_pool.apply_async(self._run_job, (asset_data,))
+        return entry.handle
+
+    @staticmethod
+    def get_job_key(asset_data):
+        """
+        identifies the job converting the given asset by the asset's id and its source file
+        :param asset_data:
+        :return:
+        """
+        return asset_data.get('id'), (asset_data.get('upload') or {}).get('file')
+
+    def handle_duplicate_job(self, asset_data):
+        """
+        checks whether the given asset is being converted already or has been converted recently. Duplicates of a
+        running job are attached to it (its result will be reported once it's done), for recently (successfully)
+        finished jobs their result is reported again
+        :param asset_data:
+        :return: whether or not the asset has been handled as a duplicate
+        """
+        key = self.get_job_key(asset_data)
+        if self.job_registry.get_running(key) is not None:
+            logger.info('Asset %s is being converted already, waiting for the running job' % asset_data.get('id'))
+            return True
+        result = self.job_registry.get_finished(key)
+        if result is not None:
+            logger.info('Asset %s has been converted recently, reporting its result again' % asset_data.get('id'))
+            self.send_message(*result, buffer=True)
+            return True
+        return False
+
+    def get_job_slots(self):
+        """
+        returns the number of jobs which can be worked on at the same time
+        :return:
+        """
+        if self.scheduler is not None:
+            # the conversion is the stage which matters
+            return self.execute_workers
+        return self.max_concurrent_jobs
+
+    def get_capacity(self):
+        """
+        describes how loaded the pipeline is: its free worker slots, the number of jobs waiting for one, the number
+        of jobs it would accept right now (credits) and the free disk space in its working directory
+        :return:
+        """
+        slots = self.get_job_slots()
+        with self.active_jobs_lock:
+            active_jobs = self.active_jobs
+        queued_jobs = max(0, active_jobs - slots)
+        free_slots = max(0, slots - active_jobs)
+        capacity = {
+            'slots': slots,
+            'free_slots': free_slots,
+            'queued_jobs': queued_jobs,
+            'max_queued_jobs': self.max_queued_jobs,
+            'free_disk_space': get_free_disk_space(self.working_directory_path),
+        }
+        if self.max_queued_jobs is not None:
+            capacity['credits'] = free_slots + max(0, self.max_queued_jobs - queued_jobs)
+        else:
+            capacity['credits'] = None
+        return capacity
+
+    def has_capacity(self, expected_size=0):
+        """
+        whether or not another job can be accepted right now
+        :param expected_size: the number of bytes the job's working directory is expected to need
+        :return:
+        """
+        if not self.working_directories.has_space(expected_size):
+            return False
+        if self.max_queued_jobs is None:
+            return True
+        with self.active_jobs_lock:
+            return self.active_jobs < self.get_job_slots() + self.max_queued_jobs
+
+    def send_capacity(self):
+        """
+        advertises the pipeline's capacity to the hub, so it can spread the jobs across all pipelines
+        :return:
+        """
+        self.send_message(MessageType.PIPELINE_CAPACITY, self.get_capacity())
+
+    def _run_job(self, asset_data):
+        """
+        runs the pipeline for the given asset inside of a pool worker
+        :param asset_data:
+        :return:
+        """
+        try:
+            result = self.run(asset_data)
+        except Exception as e:
+            # the pool would silently swallow the exception, so at least log it
+            logger.exception('Pipeline failed for asset_data %s' % asset_data)
+            self.on_job_done(asset_data, e)
+            raise
+        self.on_job_done(asset_data)
+        return result
+
+    def on_job_done(self, asset_data, error=None):
+        """
+        called once the job converting the given asset is done
+        :param asset_data:
+        :param error: the exception the job failed with (if it failed)
+        :return:
+        """
+        self.progress_reporter.finish(asset_data.get('id'))
+        # only jobs which got a working directory release it, others (e.g. jobs of the same asset) may still use it
+        if asset_data.pop('working_directory', None):
+            self.working_directories.release(asset_data.get('id'))
+        with self.active_jobs_lock:
+            self.active_jobs -= 1
+        if error is None:
+            result = MessageType.CONVERSION_SUCCESS, {'id': asset_data.get('id')}
+            self.job_registry.finish(self.get_job_key(asset_data), result)
+        else:
+            result = MessageType.CONVERSION_FAIL, {'id': asset_data.get('id'), 'error': str(error)}
+            # failures aren't remembered, the hub may retry the job (e.g. after a temporary error) right away
+            self.job_registry.finish(self.get_job_key(asset_data))
+        # the result must reach the hub, even if the connection is lost right now
+        self.send_message(*result, buffer=True)
+        self.send_capacity()
+
+    def send_message(self, msg_type, data, buffer=False):
+        """
+        sends a message of the given type to the Innoactive Hub®
+        :param msg_type: one of MessageType
+        :param data: the message's (json serializable) payload
+        :param buffer: whether to keep the message and send it once the pipeline is connected (again), if it can't
+        be sent right now. Otherwise the message is dropped
+        :return: whether or not the message could be sent
+        """
+        sent = False
+        if self.socket is not None and self.connected:
+            try:
+                self.socket.send(encode_message({'type': msg_type, 'data': data}))
+                sent = True
+            except (websocket.WebSocketException, IOError) as e:
+                logger.warn('Could not send %s message: %s' % (msg_type, e))
+        if not sent and buffer:
+            with self.outbox_lock:
+                self.outbox.append((msg_type, data))
+        return sent
+
+    def send_progress(self, progress):
+        self.send_message(MessageType.CONVERSION_PROGRESS, progress)
+
+    def report_progress(self, asset_data, progress, stage=None):
+        """
+        reports the progress of the job converting the given asset. Updates are coalesced and sent as
+        CONVERSION_PROGRESS messages at most every progress_interval seconds per job, so this may be called as often
+        as needed (e.g. from within execute). Progress reported from the execute_processes is handed to the
+        pipeline's process, which reports it
+        :param asset_data:
+        :param progress: the job's progress, between 0 and 1
+        :param stage: the part of the job which is running (e.g. 'download', 'execute' or 'upload')
+        :return:
+        """
+        if _process_progress_queue is not None:
+            _process_progress_queue.put((asset_data.get('id'), progress, stage))
+            return
+        self.progress_reporter.report(asset_data.get('id'), progress, stage)
 
     def pre_execute(self, asset_data):
         """
@@ -206,7 +808,11 @@ class BaseRemoteAssetPipeline(AbstractAssetPipeline):
         """
         logger.info("Running pre-pipeline hook for asset_data %s" % asset_data)
         # download all the asset's files and move them to a folder of our liking
-        model_working_directory = path.join(TMP_FILES_PATH, str(asset_data.get('id')))
+        model_working_directory = self.working_directories.acquire(
+            asset_data.get('id'), (asset_data.get('upload') or {}).get('size') or 0
+        )
+        # to be released once the job is done
+        asset_data['working_directory'] = model_working_directory
         download_folder = path.join(model_working_directory, 'original')
         output_folder = path.join(model_working_directory, 'converted')
         # make sure the folder exist
@@ -214,12 +820,25 @@ class BaseRemoteAssetPipeline(AbstractAssetPipeline):
             makedirs(download_folder)
         if not path.exists(output_folder):
             makedirs(output_folder)
-        # download the specified file
-        input_path = self.download_file(asset_data.get('upload').get('file'), download_folder)
-        # store the input file path inside the asset_data for later usage
+        # store the input file's location inside the asset_data for later usage
         if 'input' not in asset_data:
             asset_data['input'] = {}
-        asset_data['input']['path'] = input_path
+        if self.supports_streaming_input:
+            # the file is downloaded while executing the pipeline
+            _path = asset_data.get('upload').get('file')
+            asset_data['input']['url'] = self.get_file_url(_path)
+            asset_data['input']['path'] = path.join(download_folder, path.basename(_path)) \
+                if self.stream_input_to_disk else None
+        else:
+            # download the specified file, reporting its progress unless download_file has been overridden in a way
+            # which doesn't support it
+            kwargs = {}
+            if self.download_file_reports_progress():
+                kwargs['progress_callback'] = \
+                    lambda done, total: self.report_progress(asset_data, float(done) / total, 'download')
+            asset_data['input']['path'] = self.download_file(
+                asset_data.get('upload').get('file'), download_folder, **kwargs
+            )
         # also store the directory to which we'll output the converted files
         if 'output' not in asset_data:
             asset_data['output'] = {}
@@ -230,6 +849,61 @@ class BaseRemoteAssetPipeline(AbstractAssetPipeline):
         logger.info("Running pipeline for asset_data %s" % asset_data)
         return asset_data
 
+    def dispatch_execute(self, asset_data):
+        """
+        pipelines supporting streaming input have execute_stream run with the input file's stream, anything else is
+        up to the default implementation
+        :param asset_data:
+        :return:
+        """
+        if not self.supports_streaming_input:
+            return super(BaseRemoteAssetPipeline, self).dispatch_execute(asset_data)
+        stream = self.open_input_stream(asset_data)
+        try:
+            result = self.execute_stream(asset_data, stream)
+        except Exception:
+            stream.abort()
+            raise
+        stream.close()
+        return result
+
+    def execute_stream(self, asset_data, stream):
+        """
+        converts the input file while it's being downloaded. Only called (instead of execute) if
+        supports_streaming_input is set. asset_data['input']['path'] only points to the file (once the stream has
+        been closed) if stream_input_to_disk is set as well. Streamed conversions are neither run in the
+        execute_processes nor cached
+        :param asset_data:
+        :param stream: read-only file-like InputStream of the input file, which may be iterated in chunks as well
+        :return:
+        """
+        raise NotImplementedError('Pipelines supporting streaming input must implement the execute_stream method')
+
+    def open_input_stream(self, asset_data):
+        """
+        starts downloading the asset's input file
+        :param asset_data:
+        :return: the InputStream of the file
+        """
+        response = self.client.request('GET', asset_data['input']['url'], stream=True)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            # nobody is going to read (and thereby release) the response
+            response.close()
+            raise
+        file_size = int(response.headers.get('Content-Length') or 0)
+        progress = None
+        # the content length of encoded (e.g. gzipped) responses is not the size of the file
+        if file_size > 0 and not response.headers.get('Content-Encoding'):
+            progress = TransferProgress(
+                file_size, lambda done, total: self.report_progress(asset_data, float(done) / total, 'download')
+            )
+        return InputStream(
+            response, tee_path=asset_data['input'].get('path'), buffer_size=self.download_buffer_size,
+            progress=progress
+        )
+
     def post_execute(self, asset_data):
         """
         signal to be executed right after file conversion has ended
@@ -239,49 +913,207 @@ class BaseRemoteAssetPipeline(AbstractAssetPipeline):
         logger.info("Running post-pipeline hook for asset_data %s" % asset_data)
         return asset_data
 
-    def download_file(self, _path, folder):
+    def get_file_url(self, _path):
+        """
+        returns the url of the file located on the server at _path
+        :param _path:
+        :return:
+        """
+        return '{proto}://{host}:{port}{path}'.format(proto=self.protocol, host=self.host, port=self.port, path=_path)
+
+    def download_file_reports_progress(self):
         """
-        downloads the file located on the server at _path
+        checks whether download_file takes a progress_callback, which overrides written before it was introduced
+        don't
+        :return:
+        """
+        argspec = inspect.getargspec(self.download_file)
+        return 'progress_callback' in argspec.args or argspec.keywords is not None
+
+    def download_file(self, _path, folder, progress_callback=None):
+        """
+        downloads the file located on the server at _path. Large files are split into byte ranges which are
+        downloaded in parallel, if enabled and supported by the server. Files which have already been downloaded
+        before are taken from the download cache (if enabled)
         :param _path: the location of the file on the server
         :param folder: download folder
+        :param progress_callback: function called with the number of bytes downloaded so far and the file's size
+        (only if the server sent the file's size)
         :return:
         """
-        CHUNK_SIZE = 2000
         outfile_path = path.join(folder, path.basename(_path))
-        url = '{proto}://{host}:{port}{path}'.format(proto=self.protocol, host=self.host, port=self.port, path=_path)
+        url = self.get_file_url(_path)
         logger.debug('Downloading file from %s' % url)
-        response = self.client.request('GET', url, stream=True)
+        # if we've got the file cached, only have it sent if it changed in the meantime
+        etag = self.download_cache.get_etag(url) if self.download_cache else None
+        if self.download_cache and not etag and self.download_cache.get_validator(url):
+            # the cached file is identified by its checksum only, which can't be sent along in a conditional request,
+            # so check the current checksum before downloading the file
+            head = self.client.request('HEAD', url)
+            validator = self._get_download_validator(head) if head.ok else None
+            if validator and self.download_cache.get(url, validator, outfile_path):
+                return outfile_path
+        headers = {'If-None-Match': etag} if etag else {}
+        response = self.client.request('GET', url, stream=True, headers=headers)
+        if etag and response.status_code == 304:
+            if self.download_cache.get(url, etag, outfile_path):
+                return outfile_path
+            # the cached file has been evicted in the meantime
+            response = self.client.request('GET', url, stream=True)
         response.raise_for_status()
+        validator = self._get_download_validator(response)
+        if self.download_cache and validator and self.download_cache.get(url, validator, outfile_path):
+            # no need to read the response's body at all
+            response.close()
+            return outfile_path
+        file_size = int(response.headers.get('Content-Length') or 0)
+        # the content length of encoded (e.g. gzipped) responses is not the size of the file
+        encoded = bool(response.headers.get('Content-Encoding'))
+        progress = TransferProgress(file_size, progress_callback) if progress_callback and file_size > 0 and \
+            not encoded else None
+        if self.parallel_downloads > 1 and file_size > 0 and file_size >= self.parallel_download_min_size and \
+                response.headers.get('Accept-Ranges') == 'bytes' and not encoded:
+            response.close()
+            self._download_file_in_parallel(url, outfile_path, file_size, progress)
+        else:
+            with open(outfile_path, 'wb') as fd:
+                self._write_response_to_file(response, fd, progress)
+        if self.download_cache and validator:
+            self.download_cache.put(url, validator, outfile_path)
+        return outfile_path
+
+    @staticmethod
+    def _get_download_validator(response):
+        """
+        returns the value identifying the version of a downloaded file (its ETag or checksum), if the server sent any
+        :param response:
+        :return:
+        """
+        etag = response.headers.get('ETag')
+        # weak ETags don't guarantee byte-for-byte identical files
+        if etag and not etag.startswith('W/'):
+            return etag
+        return response.headers.get('Content-MD5')
+
+    def _download_file_in_parallel(self, url, outfile_path, file_size, progress=None):
+        """
+        downloads the file at url by fetching parallel_downloads byte ranges of it at the same time
+        :param url: the file's url
+        :param outfile_path: the path to which to download the file
+        :param file_size: the file's size in bytes
+        :param progress: TransferProgress counting the downloaded bytes (optional)
+        :return:
+        """
+        logger.debug('Downloading %s bytes from %s in %s ranges' % (file_size, url, self.parallel_downloads))
+        # preallocate the (sparse) file, so every range can be written to its final position right away
         with open(outfile_path, 'wb') as fd:
-            for chunk in response.iter_content(CHUNK_SIZE):
+            fd.truncate(file_size)
+        range_size = -(-file_size // self.parallel_downloads)
+
+        def download_range(start):
+            end = min(start + range_size, file_size) - 1
+            response = self.client.request('GET', url, stream=True, headers={
+                'Range': 'bytes={0}-{1}'.format(start, end),
+                # byte ranges refer to the unencoded file
+                'Accept-Encoding': 'identity'
+            })
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise IOError('Server did not respond with the requested range of {0}'.format(url))
+            with open(outfile_path, 'r+b') as fd:
+                fd.seek(start)
+                self._write_response_to_file(response, fd, progress)
+
+        pool = ThreadPool(processes=self.parallel_downloads)
+        try:
+            pool.map(download_range, range(0, file_size, range_size))
+        finally:
+            pool.close()
+            pool.join()
+
+    def _write_response_to_file(self, response, fd, progress=None):
+        """
+        streams the body of the (streamed) response into the given file through a single preallocated buffer. Encoded
+        (e.g. gzipped) bodies are decoded while streaming them instead
+        :param response:
+        :param fd:
+        :param progress: TransferProgress counting the written bytes (optional)
+        :return:
+        """
+        if response.headers.get('Content-Encoding'):
+            # decoded data doesn't fit into a buffer of a fixed size, so have iter_content decode it chunk by chunk
+            for chunk in response.iter_content(self.download_buffer_size):
                 fd.write(chunk)
-        return outfile_path
+                if progress is not None:
+                    progress.advance(len(chunk))
+            return
+        buf = bytearray(self.download_buffer_size)
+        view = memoryview(buf)
+        while True:
+            read = response.raw.readinto(buf)
+            if not read:
+                break
+            fd.write(view[:read])
+            if progress is not None:
+                progress.advance(read)
 
     def start(self):
         """
         start this asset pipeline and connect it to the Innoactive Hub® to listen for updates / working instructions
         :return:
         """
-        logger.info('trying to connect to {}:{}'.format(self.host, self.port))
-        # identify the converter against the host using the converter-type parameter
-        authenticated_headers = self.add_authentication_to_headers(self.additional_headers)
-        self.socket = websocket.WebSocketApp(
-            '{}://{}:{}/{}'.format('wss' if self.ssl else 'ws', self.host, self.port, self.connect_path),
-            on_message=self.on_socket_message,
-            on_error=self.on_socket_error,
-            on_close=self.on_socket_close,
-            on_open=self.on_socket_open,
-            header=authenticated_headers
-        )
-        # let it run forever
-        self.socket.run_forever()
+        # fork the worker processes running the execute step once the pipeline (including any subclass) is set up
+        # completely, but before connecting. The threads running by now (the job pool's workers and the token refresh
+        # timer) are idle, so they don't hold any locks the worker processes would inherit
+        if self.execute_processes > 0:
+            self.get_execute_pool()
+        attempt = 0
+        while not self.stopping.is_set():
+            logger.info('trying to connect to {}:{}'.format(self.host, self.port))
+            # identify the converter against the host using the converter-type parameter. The access token might
+            # have been refreshed in the meantime, so authenticate every connection attempt anew
+            authenticated_headers = self.add_authentication_to_headers(dict(self.additional_headers))
+            self.socket = websocket.WebSocketApp(
+                '{}://{}:{}/{}'.format('wss' if self.ssl else 'ws', self.host, self.port, self.connect_path),
+                on_message=self.on_socket_message,
+                on_error=self.on_socket_error,
+                on_close=self.on_socket_close,
+                on_open=self.on_socket_open,
+                header=authenticated_headers
+            )
+            connections = self.connections
+            # let it run until the connection is lost
+            self.socket.run_forever()
+            self.connected = False
+            if self.stopping.is_set() or not self.reconnect:
+                break
+            # start over with short delays once we've been connected successfully
+            attempt = 0 if self.connections > connections else attempt + 1
+            delay = self.get_reconnect_delay(attempt)
+            logger.warn('Lost connection to Innoactive® Hub, reconnecting in %.1f seconds' % delay)
+            self.stopping.wait(delay)
+
+    def get_reconnect_delay(self, attempt):
+        """
+        returns the number of seconds to wait before the next connection attempt. The delay grows exponentially
+        with the number of failed attempts and is randomized ("full jitter"), so a hub restart doesn't have all
+        pipelines reconnect at the very same time
+        :param attempt: number of connection attempts which failed in a row
+        :return:
+        """
+        return random.uniform(0, min(self.reconnect_max_delay, self.reconnect_min_delay * 2 ** attempt))
 
     def stop(self):
         """
         stop this converter and disconnect from holocloud
         :return:
         """
+        self.stopping.set()
         self.socket.close()
+        self.progress_reporter.stop()
+        if self.scheduler is not None:
+            self.scheduler.close()
+        self.close_execute_pool()
 
 
 class PlatformSpecificAssetPipelineMixin(object):
@@ -381,9 +1213,9 @@ class NoopRemoteAssetPipeline(BaseRemoteAssetPipeline):
             shutil.rmtree(output_folder)
         # ... and recreate it afterwards
         makedirs(output_folder)
-        # start copying everything from the input_file's folder to the output folder
+        # start materializing everything from the input_file's folder in the output folder
         from_dir = path.dirname(input_file)
         to_dir = output_folder
-        copy_tree(from_dir, to_dir)
+        self.materialize(from_dir, to_dir)
         # return the path to the "converted" file
         return asset_data
@@ -0,0 +1,90 @@
+import os
+import threading
+
+from logger import logger
+
+
+class TransferProgress(object):
+    """
+    counts the bytes transferred so far (possibly by several threads at once) and passes them on to a progress
+    callback along with the total number of bytes
+    """
+    def __init__(self, total, callback):
+        self.total = total
+        self.callback = callback
+        self.done = 0
+        self.lock = threading.Lock()
+
+    def advance(self, transferred):
+        with self.lock:
+            self.done += transferred
+            done = self.done
+        self.callback(done, self.total)
+
+    def set(self, done):
+        with self.lock:
+            self.done = done
+        self.callback(done, self.total)
+
+
+class ProgressReporter(object):
+    """
+    coalesces the progress updates of all jobs and sends at most one of them per job every interval seconds.
+
+    reporting progress only stores the most recent update of the job, so it can be called as often as needed
+    (e.g. for every chunk of data written). The updates are sent from a background thread
+    """
+    def __init__(self, send, interval=1.0):
+        """
+        :param send: function called with the data of a job's most recent progress update
+        :param interval: number of seconds in between two updates sent for the same job
+        """
+        self.send = send
+        self.interval = interval
+        # the most recent (not yet sent) progress update per job
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+        # progress reported by forked worker processes can't be sent on our connection
+        self.pid = os.getpid()
+
+    def report(self, job_id, progress, stage=None):
+        """
+        records the progress of the given job
+        :param job_id: the id of the job (asset)
+        :param progress: the job's progress, between 0 and 1
+        :param stage: the part of the job which is running (e.g. 'download', 'execute' or 'upload')
+        :return:
+        """
+        if os.getpid() != self.pid:
+            return
+        with self.lock:
+            self.pending[job_id] = {'id': job_id, 'progress': max(0.0, min(1.0, progress)), 'stage': stage}
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._send_pending, name='progress-reporter')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def finish(self, job_id):
+        """
+        drops any pending update of the given job, as its result is reported instead
+        :param job_id:
+        :return:
+        """
+        with self.lock:
+            self.pending.pop(job_id, None)
+
+    def stop(self):
+        self.stopped.set()
+
+    def _send_pending(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                updates = self.pending.values()
+                self.pending = {}
+            for update in updates:
+                try:
+                    self.send(update)
+                except Exception:
+                    logger.exception('Could not report progress of job %s' % update['id'])
@@ -24,6 +24,10 @@ class MessageType(object):
     CONVERSION_PROGRESS = 'CONVERSION_PROGRESS'
     CONVERSION_SUCCESS = 'CONVERSION_SUCCESS'
     CONVERSION_FAIL = 'CONVERSION_FAIL'
+    # sent by the pipeline if it can't take any more jobs right now
+    CONVERSION_REJECTED = 'CONVERSION_REJECTED'
+    # sent by the pipeline to advertise how many more jobs it can take (on connect and whenever a job is done)
+    PIPELINE_CAPACITY = 'PIPELINE_CAPACITY'
 
 
 class ConversionState(object):
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from os import path
+
+from logger import logger
+from materialize import materialize_tree
+
+# settings concerning the connection, authentication and the way jobs are run, which don't affect the outcome of a
+# conversion (and therefore are no part of the result cache's keys)
+OPERATIONAL_SETTINGS = frozenset([
+    'host', 'port', 'ssl', 'protocol', 'config_file',
+    'client_id', 'client_secret', 'auth_code', 'username', 'password',
+    'pool_connections', 'pool_maxsize', 'pool_block', 'max_retries', 'retry_backoff_factor',
+    'background_token_refresh', 'token_refresh_margin', 'token_cache_file',
+    'max_concurrent_jobs', 'max_concurrent_executions', 'execute_processes', 'max_queued_jobs',
+    'staged_jobs', 'pre_execute_workers', 'execute_workers', 'post_execute_workers', 'stage_queue_size',
+    'download_buffer_size', 'parallel_downloads', 'parallel_download_min_size',
+    'download_cache_size', 'download_cache_path', 'http_cache_size', 'result_cache_size', 'result_cache_path',
+    'progress_interval', 'reconnect', 'reconnect_min_delay', 'reconnect_max_delay', 'finished_jobs_ttl',
+    'working_directory_path', 'working_directory_budget', 'working_directory_timeout', 'stream_input_to_disk',
+])
+
+# stands in for the output folder of the job inside of the cached changes to asset_data
+OUTPUT_FOLDER_PLACEHOLDER = '<output>'
+
+
+def hash_file(file_path, buffer_size=1 << 20):
+    """
+    computes the sha1 hash of the given file's content
+    :param file_path:
+    :param buffer_size:
+    :return:
+    """
+    hashing_function = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for piece in iter(lambda: f.read(buffer_size), b''):
+            hashing_function.update(piece)
+    return hashing_function.hexdigest()
+
+
+def get_changes(before, after):
+    """
+    returns the items of the (nested) dictionary after which have been added or changed compared to before
+    :param before:
+    :param after:
+    :return:
+    """
+    changes = {}
+    for key, value in after.items():
+        if isinstance(value, dict) and isinstance(before.get(key), dict):
+            nested_changes = get_changes(before[key], value)
+            if nested_changes:
+                changes[key] = nested_changes
+        elif key not in before or before[key] != value:
+            changes[key] = value
+    return changes
+
+
+def apply_changes(data, changes):
+    """
+    applies the changes returned by get_changes to the (nested) dictionary data
+    :param data:
+    :param changes:
+    :return:
+    """
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            apply_changes(data[key], value)
+        else:
+            data[key] = value
+
+
+def relocate(value, old_path, new_path):
+    """
+    replaces old_path by new_path at the beginning of all strings inside of value (recursively)
+    :param value:
+    :param old_path:
+    :param new_path:
+    :return:
+    """
+    if isinstance(value, dict):
+        return dict((key, relocate(item, old_path, new_path)) for key, item in value.items())
+    if isinstance(value, list):
+        return [relocate(item, old_path, new_path) for item in value]
+    if isinstance(value, basestring) and value.startswith(old_path):
+        return new_path + value[len(old_path):]
+    return value
+
+
+def get_folder_size(folder):
+    return sum(
+        path.getsize(path.join(root, name)) for root, _, names in os.walk(folder) for name in names
+    )
+
+
+class ResultCache(object):
+    """
+    cache of conversion results (the contents of the jobs' output folders along with the changes execute made to
+    asset_data), keyed by the hash of the input file's content, the pipeline (class and version) and the pipeline's
+    settings, so converting an unchanged file again only restores the cached output.
+
+    cached files are reflinked (or copied) in and out of the cache, never hardlinked, so jobs modifying their output
+    can't change cached results. The least recently used results are evicted once the cache grows beyond max_size
+    bytes
+    """
+    def __init__(self, root, max_size):
+        self.root = root
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        if not path.exists(self.root):
+            os.makedirs(self.root)
+
+    @staticmethod
+    def get_key(input_path, pipeline, settings):
+        """
+        :param input_path: the file to be converted
+        :param pipeline: identifies the pipeline (class and version) converting the file
+        :param settings: the (json serializable) settings affecting the conversion
+        :return:
+        """
+        return hashlib.sha1('\n'.join([
+            hash_file(input_path), pipeline, json.dumps(settings, sort_keys=True, default=str)
+        ])).hexdigest()
+
+    def restore(self, key, output_folder):
+        """
+        provides the cached result at output_folder (replacing anything inside of it)
+        :param key:
+        :param output_folder:
+        :return: the changes execute made to asset_data (see get_changes), or None if the result was not cached
+        """
+        cache_folder = path.join(self.root, key)
+        with self.lock:
+            if not path.isdir(path.join(cache_folder, 'output')):
+                return None
+            # mark the result as recently used
+            os.utime(cache_folder, None)
+            with open(path.join(cache_folder, 'changes.json')) as f:
+                changes = json.load(f)
+            if path.exists(output_folder):
+                shutil.rmtree(output_folder)
+            materialize_tree(path.join(cache_folder, 'output'), output_folder, allow_hardlink=False)
+        logger.debug('Using cached conversion result %s' % key)
+        # paths inside of the output folder refer to the folder of the job restoring the result
+        return relocate(changes, OUTPUT_FOLDER_PLACEHOLDER, output_folder)
+
+    def store(self, key, output_folder, changes=None):
+        """
+        adds the contents of output_folder to the cache
+        :param key:
+        :param output_folder:
+        :param changes: the changes execute made to asset_data (see get_changes)
+        :return:
+        """
+        cache_folder = path.join(self.root, key)
+        with self.lock:
+            if path.isdir(cache_folder):
+                return
+            # copy to a temporary folder first, so no job ever restores a partial result
+            tmp_folder = '{0}.tmp'.format(cache_folder)
+            if path.exists(tmp_folder):
+                shutil.rmtree(tmp_folder)
+            materialize_tree(output_folder, path.join(tmp_folder, 'output'), allow_hardlink=False)
+            with open(path.join(tmp_folder, 'changes.json'), 'w') as f:
+                json.dump(relocate(changes or {}, output_folder, OUTPUT_FOLDER_PLACEHOLDER), f, default=str)
+            os.rename(tmp_folder, cache_folder)
+            self._evict()
+
+    def _evict(self):
+        """
+        removes the least recently used results until the cache fits into max_size again
+        """
+        entries = []
+        for name in os.listdir(self.root):
+            folder = path.join(self.root, name)
+            entries.append((os.stat(folder).st_mtime, get_folder_size(folder), name))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            logger.debug('Evicting %s from the result cache' % name)
+            shutil.rmtree(path.join(self.root, name))
+            size -= entry_size
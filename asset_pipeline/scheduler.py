@@ -0,0 +1,138 @@
+import threading
+from Queue import Queue
+
+from logger import logger
+
+# put into the queue of a stage to let its workers exit
+_STOP = object()
+
+
+class StagedJob(object):
+    """
+    handle of a job run by the StagedScheduler, similar to the AsyncResult of a pool
+    """
+    def __init__(self, asset_data):
+        self.asset_data = asset_data
+        self.error = None
+        self.event = threading.Event()
+
+    def ready(self):
+        return self.event.is_set()
+
+    def successful(self):
+        return self.ready() and self.error is None
+
+    def wait(self, timeout=None):
+        self.event.wait(timeout)
+
+    def get(self, timeout=None):
+        """
+        waits for the job to pass all stages
+        :param timeout:
+        :return: the job's asset_data
+        """
+        self.wait(timeout)
+        if not self.ready():
+            raise RuntimeError('Job has not finished yet')
+        if self.error is not None:
+            raise self.error
+        return self.asset_data
+
+
+class _Stage(object):
+    def __init__(self, name, function, workers, queue):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue = queue
+        self.running_workers = workers
+        self.lock = threading.Lock()
+
+
+class StagedScheduler(object):
+    """
+    runs jobs through a sequence of stages (e.g. download, convert and upload), each of which has its own workers.
+    A job is handed over to the next stage as soon as it passed the current one, so while one job is being
+    converted, the next one can already be downloaded and the previous one uploaded.
+
+    the queues between two stages are bounded, so a stage which can't keep up slows down the ones before it instead
+    of having finished work pile up. Jobs which fail in any stage skip the remaining ones
+    """
+    def __init__(self, stages, queue_size=1, on_done=None):
+        """
+        :param stages: list of (name, function, workers) tuples. Each function is called with the job's asset_data
+        :param queue_size: number of jobs which may wait in between two stages
+        :param on_done: function called with the job's asset_data and exception (or None) once it's done
+        """
+        self.on_done = on_done
+        self.stages = []
+        for index, (name, function, workers) in enumerate(stages):
+            # jobs are submitted from the websocket's thread, which must never be blocked
+            queue = Queue(maxsize=queue_size if index > 0 else 0)
+            self.stages.append(_Stage(name, function, max(1, workers), queue))
+        self.threads = []
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work, args=(index,), name='{0}-{1}'.format(stage.name, worker)
+                )
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, asset_data):
+        """
+        queues the given asset for the first stage
+        :param asset_data:
+        :return: the StagedJob
+        """
+        job = StagedJob(asset_data)
+        self.stages[0].queue.put(job)
+        return job
+
+    def close(self):
+        """
+        lets the workers exit once all jobs submitted so far have passed all stages
+        :return:
+        """
+        for _ in range(self.stages[0].workers):
+            self.stages[0].queue.put(_STOP)
+
+    def join(self, timeout=None):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _work(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            job = stage.queue.get()
+            if job is _STOP:
+                with stage.lock:
+                    stage.running_workers -= 1
+                    last_worker = stage.running_workers == 0
+                # the next stage has to finish the jobs this one already handed over before stopping as well
+                if last_worker and next_stage is not None:
+                    for _ in range(next_stage.workers):
+                        next_stage.queue.put(_STOP)
+                return
+            try:
+                stage.function(job.asset_data)
+            except Exception as e:
+                logger.exception('Stage %s failed for asset_data %s' % (stage.name, job.asset_data))
+                self._finish(job, e)
+                continue
+            if next_stage is not None:
+                # blocks while the next stage is busy
+                next_stage.queue.put(job)
+            else:
+                self._finish(job)
+
+    def _finish(self, job, error=None):
+        job.error = error
+        if self.on_done is not None:
+            try:
+                self.on_done(job.asset_data, error)
+            except Exception:
+                logger.exception('Could not finish job for asset_data %s' % job.asset_data)
+        job.event.set()
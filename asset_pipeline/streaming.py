@@ -0,0 +1,93 @@
+import os
+from os import path
+
+
+class InputStream(object):
+    """
+    read-only file-like stream of a (streamed) response's body, which lets pipelines convert a file while it's still
+    being downloaded. Everything read can be written to a file on the side ("tee"), in case the file is needed
+    again later on
+    """
+    def __init__(self, response, tee_path=None, buffer_size=1 << 20, progress=None):
+        """
+        :param response: the streamed response
+        :param tee_path: the path to which the body is written while reading it (optional)
+        :param buffer_size: the size of the chunks the stream is iterated in
+        :param progress: TransferProgress counting the read bytes (optional)
+        """
+        self.response = response
+        # iter_content decodes any content encoding (e.g. gzip), which is why its chunks may be of any size
+        self.chunks = response.iter_content(buffer_size)
+        # decoded data which has not been read yet
+        self.leftover = b''
+        self.tee_path = tee_path
+        self.tee = open(tee_path, 'wb') if tee_path else None
+        self.buffer_size = buffer_size
+        self.progress = progress
+        self.closed = False
+
+    def read(self, size=-1):
+        """
+        reads size bytes (or less only if the end of the body is reached) or everything that's left if size is
+        negative or None
+        :param size:
+        :return: the data read, empty once the end of the body is reached
+        """
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(self.buffer_size), b''))
+        pieces = [self.leftover]
+        available = len(self.leftover)
+        while available < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            pieces.append(chunk)
+            available += len(chunk)
+        data = b''.join(pieces)
+        data, self.leftover = data[:size], data[size:]
+        if data:
+            if self.tee is not None:
+                self.tee.write(data)
+            if self.progress is not None:
+                self.progress.advance(len(data))
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.buffer_size), b'')
+
+    def close(self):
+        """
+        closes the stream. If the body is written to a file, the rest of it is read first, so the file is complete
+        :return:
+        """
+        if self.closed:
+            return
+        if self.tee is not None:
+            for _ in self:
+                pass
+            self.tee.close()
+        self.response.close()
+        self.closed = True
+
+    def abort(self):
+        """
+        closes the stream without reading the rest of the body, removing the incomplete file it has been written to
+        :return:
+        """
+        if self.closed:
+            return
+        self.response.close()
+        if self.tee is not None:
+            self.tee.close()
+            if path.exists(self.tee_path):
+                os.remove(self.tee_path)
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
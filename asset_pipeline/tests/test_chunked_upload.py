@@ -0,0 +1,261 @@
+import cgi
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+from unittest import TestCase
+
+import requests
+import requests_mock
+
+from ..chunked_upload import ChunkedUploadMixin
+
+
+BASE_URL = 'http://server.test/api/'
+UPLOAD_ID = 'myuploadid'
+FILE_URL = 'http://server.test/media/uploaded.bin'
+CHUNK_SIZE = 1024
+
+
+def get_response(content, request, status_code=200):
+    """
+    Helper function to construct a json requests response
+    :param content:
+    :param request:
+    :param status_code:
+    :return:
+    """
+    response = requests.Response()
+    response.status_code = status_code
+    response.request = request
+    response._content = json.dumps(content)
+    return response
+
+
+def get_chunk(request):
+    """
+    Helper function to get the uploaded chunk out of a multipart request
+    :param request:
+    :return:
+    """
+    body = request.body
+    if not isinstance(body, str):
+        # streamed bodies hand out their data in slices
+        body = ''.join(str(piece) for piece in iter(body.read, ''))
+    form = cgi.FieldStorage(
+        fp=BytesIO(body), headers={'content-type': request.headers['Content-Type']},
+        environ={'REQUEST_METHOD': 'POST'}
+    )
+    return form['chunk'].value
+
+
+class ChunkedUploadMockServer(object):
+    """
+    Mock implementation of the hub's chunked upload endpoints
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = bytearray()
+        self.requests = []
+        # offset of a chunk for which the connection breaks down (once)
+        self.fail_at_offset = None
+
+    def __call__(self, request):
+        with self.lock:
+            self.requests.append((request.method, request.path_url, dict(request.headers)))
+        if request.method == 'POST' and request.path_url == '/api/chunked_uploads/':
+            chunk = get_chunk(request)
+            with self.lock:
+                self.data[0:len(chunk)] = chunk
+            return get_response({'upload_id': UPLOAD_ID, 'offset': len(chunk)}, request)
+        if request.method == 'PUT' and request.path_url == '/api/chunked_uploads/%s/' % UPLOAD_ID:
+            start, end = map(int, re.match(r'bytes (\d+)-(\d+)/\d+', request.headers['Content-Range']).groups())
+            if start == self.fail_at_offset:
+                self.fail_at_offset = None
+                raise requests.ConnectionError('Connection aborted.')
+            chunk = get_chunk(request)
+            assert len(chunk) == end - start + 1
+            with self.lock:
+                if len(self.data) < start:
+                    self.data.extend('\0' * (start - len(self.data)))
+                self.data[start:end + 1] = chunk
+            return get_response({'upload_id': UPLOAD_ID, 'offset': end + 1}, request)
+        if request.method == 'POST' and request.path_url == '/api/chunked_uploads/%s/commit/' % UPLOAD_ID:
+            form = cgi.FieldStorage(
+                fp=BytesIO(request.body), headers={'content-type': request.headers['Content-Type']},
+                environ={'REQUEST_METHOD': 'POST'}
+            )
+            if form['md5'].value != hashlib.md5(self.data).hexdigest():
+                return get_response({'md5': 'md5 checksum does not match'}, request, status_code=400)
+            return get_response({'file_url': FILE_URL}, request)
+
+
+class Uploader(ChunkedUploadMixin):
+    def __init__(self, adapter, upload_journal_path):
+        self.upload_journal_path = upload_journal_path
+        self.client = requests.Session()
+        # remove standard http and https adapters
+        self.client.adapters = OrderedDict()
+        self.client.mount('http', adapter)
+
+
+class TestChunkedUpload(TestCase):
+    def setUp(self):
+        self.server = ChunkedUploadMockServer()
+        adapter = requests_mock.Adapter()
+        adapter.add_matcher(self.server)
+        self.directory = tempfile.mkdtemp()
+        self.uploader = Uploader(adapter, os.path.join(self.directory, 'journal.json'))
+        self.file_path = os.path.join(self.directory, 'upload.bin')
+        self.content = os.urandom(10 * CHUNK_SIZE + 123)
+        with open(self.file_path, 'wb') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def upload(self, **kwargs):
+        return self.uploader._chunked_upload_file(BASE_URL, self.file_path, chunk_size_bytes=CHUNK_SIZE, **kwargs)
+
+    def test_sequential_upload(self):
+        """
+        Uploads the file chunk by chunk and commits it using its md5 hash
+        :return:
+        """
+        response = self.upload()
+        self.assertEquals(response.json()['file_url'], FILE_URL)
+        self.assertEquals(bytes(self.server.data), self.content)
+
+    def test_parallel_upload(self):
+        """
+        Uploads the remaining chunks in parallel, each with its explicit Content-Range
+        :return:
+        """
+        response = self.upload(parallel_uploads=4)
+        self.assertEquals(response.json()['file_url'], FILE_URL)
+        self.assertEquals(bytes(self.server.data), self.content)
+        content_ranges = sorted(
+            headers['Content-Range'] for method, _, headers in self.server.requests if method == 'PUT'
+        )
+        self.assertEquals(len(content_ranges), 10)
+        self.assertIn('bytes %d-%d/%d' % (CHUNK_SIZE, 2 * CHUNK_SIZE - 1, len(self.content)), content_ranges)
+
+    def test_parallel_upload_memory_bound(self):
+        """
+        Reads no more chunks into memory than are being uploaded in parallel
+        :return:
+        """
+        lock = threading.Lock()
+        counts = {'read': 0, 'uploaded': 0, 'max_in_memory': 0}
+
+        def read_chunks():
+            for _ in range(20):
+                with lock:
+                    counts['read'] += 1
+                    counts['max_in_memory'] = max(counts['max_in_memory'], counts['read'] - counts['uploaded'])
+                yield 'chunk', 5
+
+        def upload_chunk(offset, chunk, chunk_size):
+            time.sleep(0.01)
+            with lock:
+                counts['uploaded'] += 1
+            return get_response({}, None)
+
+        self.assertIsNone(self.uploader._upload_chunks_in_parallel(read_chunks(), 0, upload_chunk, 4))
+        self.assertEquals(counts['uploaded'], 20)
+        self.assertLessEqual(counts['max_in_memory'], 4)
+
+    def test_parallel_upload_stops_on_connection_errors(self):
+        """
+        Stops reading and sending further chunks once sending a chunk raised an exception
+        :return:
+        """
+        lock = threading.Lock()
+        attempts = []
+
+        def read_chunks():
+            for _ in range(1000):
+                yield 'chunk', 5
+
+        def upload_chunk(offset, chunk, chunk_size):
+            with lock:
+                attempts.append(offset)
+            raise requests.ConnectionError('Connection aborted.')
+
+        with self.assertRaises(requests.ConnectionError):
+            self.uploader._upload_chunks_in_parallel(read_chunks(), 0, upload_chunk, 4)
+        self.assertLessEqual(len(attempts), 8)
+
+    def test_resume_interrupted_upload(self):
+        """
+        Continues an interrupted upload at the last acknowledged offset instead of starting from scratch
+        :return:
+        """
+        self.server.fail_at_offset = 5 * CHUNK_SIZE
+        with self.assertRaises(requests.ConnectionError):
+            self.upload()
+        del self.server.requests[:]
+        response = self.upload()
+        self.assertEquals(response.json()['file_url'], FILE_URL)
+        self.assertEquals(bytes(self.server.data), self.content)
+        # the first chunk has not been posted again, the upload continued at the failed chunk
+        self.assertEquals(self.server.requests[0][0], 'PUT')
+        self.assertEquals(
+            self.server.requests[0][2]['Content-Range'],
+            'bytes %d-%d/%d' % (5 * CHUNK_SIZE, 6 * CHUNK_SIZE - 1, len(self.content))
+        )
+
+    def test_resume_interrupted_parallel_upload(self):
+        """
+        Continues an interrupted parallel upload without gaps in the uploaded data
+        :return:
+        """
+        self.server.fail_at_offset = 5 * CHUNK_SIZE
+        with self.assertRaises(requests.ConnectionError):
+            self.upload(parallel_uploads=4)
+        response = self.upload(parallel_uploads=4)
+        self.assertEquals(response.json()['file_url'], FILE_URL)
+        self.assertEquals(bytes(self.server.data), self.content)
+
+    def test_memory_mapped_upload(self):
+        """
+        Streams the chunks straight out of the memory mapped file
+        :return:
+        """
+        self.uploader.memory_mapped_uploads = True
+        response = self.upload(parallel_uploads=4)
+        self.assertEquals(response.json()['file_url'], FILE_URL)
+        self.assertEquals(bytes(self.server.data), self.content)
+
+    def test_adaptive_chunk_size(self):
+        """
+        Grows the chunks as long as uploading them takes less than the targeted duration
+        :return:
+        """
+        self.uploader.adaptive_chunk_size = True
+        self.uploader.min_chunk_size_bytes = CHUNK_SIZE
+        self.uploader.max_chunk_size_bytes = 4 * CHUNK_SIZE
+        self.uploader.target_chunk_duration = 60
+        response = self.upload()
+        self.assertEquals(response.json()['file_url'], FILE_URL)
+        self.assertEquals(bytes(self.server.data), self.content)
+        content_ranges = [headers['Content-Range'] for method, _, headers in self.server.requests if method == 'PUT']
+        self.assertEquals(content_ranges[0], 'bytes %d-%d/%d' % (CHUNK_SIZE, 3 * CHUNK_SIZE - 1, len(self.content)))
+        self.assertEquals(content_ranges[1], 'bytes %d-%d/%d' % (3 * CHUNK_SIZE, 7 * CHUNK_SIZE - 1, len(self.content)))
+
+    def test_progress_callback(self):
+        """
+        Reports the number of bytes acknowledged by the server after every chunk
+        :return:
+        """
+        progress = []
+        self.upload(progress_callback=lambda done, total: progress.append((done, total)))
+        self.assertEquals(len(progress), 11)
+        self.assertEquals(progress[0], (CHUNK_SIZE, len(self.content)))
+        self.assertEquals(progress[-1], (len(self.content), len(self.content)))
@@ -1,4 +1,10 @@
 import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
 from collections import OrderedDict
 from urlparse import urljoin, parse_qs
 from unittest import TestCase
@@ -7,7 +13,8 @@ import requests
 import requests_mock
 from oauthlib.oauth2.rfc6749.errors import InvalidGrantError
 
-from ..client import get_client_for_config
+from ..client import ClientFactory, TokenCache, get_client_for_config
+from ..http_cache import ResponseCache, add_http_cache
 
 
 HOST = 'sever.test'
@@ -131,6 +138,28 @@ def match_mock_endpoint(request):
                     )
 
 
+class ManualTimer(object):
+    """
+    Stands in for threading.Timer, so tests can decide when the timer fires
+    """
+    def __init__(self, interval, function):
+        self.interval = interval
+        self.function = function
+        self.daemon = False
+        self.started = False
+        self.cancelled = False
+
+    def start(self):
+        self.started = True
+
+    def cancel(self):
+        self.cancelled = True
+
+    def fire(self):
+        if self.started and not self.cancelled:
+            self.function()
+
+
 class OAuthMockServer(TestCase):
     """
     Base for oauth tests
@@ -179,8 +208,11 @@ class TestClient(OAuthMockServer):
         }
         # password grant client
         self.legacy_client = get_client_for_config(legacy_config, **common_kwargs)
+        # stop refreshing the tokens in the background once the test is done (even if setting it up fails)
+        self.addCleanup(self.legacy_client.cancel_token_refresh)
         # code grant client
         self.mail_client = get_client_for_config(mail_config, state=STATE, **common_kwargs)
+        self.addCleanup(self.mail_client.cancel_token_refresh)
 
     def test_legacy_client(self):
         """
@@ -283,3 +315,209 @@ class TestClient(OAuthMockServer):
         self.mail_client.token['refresh_token'] = 'invalidrefreshtoken'
         with self.assertRaises(InvalidGrantError):
             self.mail_client.request('GET', urljoin(BASE_URL, MOCK_ENDPOINT))
+
+
+class CountingOAuthMockServer(TestCase):
+    """
+    Base for tests which need to know about the token requests sent by a password grant client
+    """
+    # lifetime of the tokens handed out
+    expires_in = 3600
+    # time it takes to hand out a token
+    token_delay = 0
+
+    def setUp(self):
+        self.grant_types = []
+        self.lock = threading.Lock()
+        # the timers refreshing the tokens in the background only fire when told to
+        self.timers = []
+
+        def create_timer(interval, function):
+            timer = ManualTimer(interval, function)
+            self.timers.append(timer)
+            return timer
+
+        self.timer_class = ClientFactory.__dict__['timer_class']
+        ClientFactory.timer_class = staticmethod(create_timer)
+
+        def match_counting_token_request(request):
+            if request.path_url == TOKEN_RELATIVE_URL:
+                with self.lock:
+                    self.grant_types.append(get_data(request.body).get('grant_type'))
+                time.sleep(self.token_delay)
+                return get_response(dict(TOKEN, expires_in=self.expires_in), request, is_json=True)
+
+        self.adapter = requests_mock.Adapter()
+        self.adapter.add_matcher(match_counting_token_request)
+        self.adapter.add_matcher(match_mock_endpoint)
+        self.clients = []
+        self.client = self.get_client()
+
+    def get_client(self, **config):
+        def pre_fetch_token_function(client):
+            # remove standard http and https adapters
+            client.adapters = OrderedDict()
+            # mount mock adapter
+            client.mount(PROTOCOL, self.adapter)
+
+        config.update({
+            'host': HOST,
+            'port': PORT,
+            'protocol': PROTOCOL,
+            'ssl': False,
+            'client_id': 'myclient',
+            'client_secret': 'mysecret',
+            'username': 'myuser',
+            'password': 'mypass'
+        })
+        client = get_client_for_config(
+            config, pre_fetch_token=pre_fetch_token_function, rel_auth_url=AUTH_RELATIVE_URL,
+            rel_token_url=TOKEN_RELATIVE_URL
+        )
+        self.clients.append(client)
+        return client
+
+    def tearDown(self):
+        for client in self.clients:
+            client.cancel_token_refresh()
+        ClientFactory.timer_class = self.timer_class
+
+
+class TestBackgroundTokenRefresh(CountingOAuthMockServer):
+    # hand out tokens which expire within 2 seconds
+    expires_in = 2
+
+    def test_refresh_before_expiry(self):
+        """
+        Refreshes the access token in the background before it expires.
+        :return:
+        """
+        self.assertEquals(self.grant_types, [PASSWORD_GRANT])
+        timer = self.timers[-1]
+        # tokens living shorter than the margin are refreshed half way through their lifetime
+        self.assertTrue(timer.started)
+        self.assertLessEqual(timer.interval, 1)
+        timer.fire()
+        self.assertEquals(self.grant_types, [PASSWORD_GRANT, REFRESH_GRANT])
+        # the refreshed token is refreshed in the background again
+        self.assertIsNot(self.timers[-1], timer)
+        response = self.client.request('GET', urljoin(BASE_URL, MOCK_ENDPOINT))
+        self.assertEquals(response.content, RESPONSE)
+        self.assertEquals(len(self.grant_types), 2)
+
+
+class TestSingleFlightTokenRefresh(CountingOAuthMockServer):
+    token_delay = 0.2
+
+    def request_concurrently(self, count=8):
+        responses = []
+
+        def request():
+            responses.append(self.client.request('GET', urljoin(BASE_URL, MOCK_ENDPOINT)))
+
+        threads = [threading.Thread(target=request) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_concurrent_unauthorized_requests(self):
+        """
+        Concurrent requests rejected with the same invalid access token trigger a single refresh.
+        :return:
+        """
+        self.client._client.access_token = 'invalidaccesstoken'
+        responses = self.request_concurrently()
+        self.assertEquals([response.content for response in responses], [RESPONSE] * 8)
+        self.assertEquals(self.grant_types, [PASSWORD_GRANT, REFRESH_GRANT])
+
+    def test_concurrent_requests_with_expired_token(self):
+        """
+        Concurrent requests using an expired access token trigger a single refresh.
+        :return:
+        """
+        self.client._client._expires_at = 1
+        responses = self.request_concurrently()
+        self.assertEquals([response.content for response in responses], [RESPONSE] * 8)
+        self.assertEquals(self.grant_types, [PASSWORD_GRANT, REFRESH_GRANT])
+
+
+class TestTokenCache(CountingOAuthMockServer):
+    def setUp(self):
+        super(TestTokenCache, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.token_cache_file = os.path.join(self.directory, 'token')
+
+    def tearDown(self):
+        super(TestTokenCache, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def test_reuse_cached_token(self):
+        """
+        Reuses the cached token on the next start instead of going through the password grant again.
+        :return:
+        """
+        self.get_client(token_cache_file=self.token_cache_file)
+        self.assertEquals(stat.S_IMODE(os.stat(self.token_cache_file).st_mode), 0o600)
+        client = self.get_client(token_cache_file=self.token_cache_file)
+        self.assertEquals(self.grant_types, [PASSWORD_GRANT, PASSWORD_GRANT])
+        response = client.request('GET', urljoin(BASE_URL, MOCK_ENDPOINT))
+        self.assertEquals(response.content, RESPONSE)
+
+    def test_refresh_expired_cached_token(self):
+        """
+        Refreshes an expired cached token on the next start instead of going through the password grant again.
+        :return:
+        """
+        client = self.get_client(token_cache_file=self.token_cache_file)
+        client.token['expires_at'] = 1
+        TokenCache(self.token_cache_file, BASE_URL + '/', 'myclient', 'myuser').save(client.token)
+        self.get_client(token_cache_file=self.token_cache_file)
+        self.assertEquals(self.grant_types, [PASSWORD_GRANT, PASSWORD_GRANT, REFRESH_GRANT])
+
+
+class TestHTTPCache(TestCase):
+    ETAG = '"myetag"'
+
+    def setUp(self):
+        self.requests = []
+
+        def match_cached_endpoint(request):
+            if request.path_url == MOCK_ENDPOINT:
+                self.requests.append(request)
+                if request.headers.get('If-None-Match') == self.ETAG:
+                    return get_response('', request, status_code=304)
+                response = get_response(RESPONSE, request)
+                response.headers['ETag'] = self.ETAG
+                return response
+
+        adapter = requests_mock.Adapter()
+        adapter.add_matcher(match_cached_endpoint)
+        self.client = requests.Session()
+        # remove standard http and https adapters
+        self.client.adapters = OrderedDict()
+        self.client.mount(PROTOCOL, adapter)
+        add_http_cache(self.client, ResponseCache(max_entries=1))
+
+    def test_conditional_request(self):
+        """
+        Revalidates a cached response using its ETag and returns the cached response if it has not been modified.
+        :return:
+        """
+        response = self.client.request('GET', urljoin(BASE_URL, MOCK_ENDPOINT))
+        self.assertEquals(response.content, RESPONSE)
+        response = self.client.request('GET', urljoin(BASE_URL, MOCK_ENDPOINT))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.content, RESPONSE)
+        self.assertNotIn('If-None-Match', self.requests[0].headers)
+        self.assertEquals(self.requests[1].headers['If-None-Match'], self.ETAG)
+
+    def test_streamed_request_not_cached(self):
+        """
+        Never caches the bodies of streamed responses.
+        :return:
+        """
+        self.client.request('GET', urljoin(BASE_URL, MOCK_ENDPOINT), stream=True)
+        self.client.request('GET', urljoin(BASE_URL, MOCK_ENDPOINT), stream=True)
+        self.assertNotIn('If-None-Match', self.requests[1].headers)
@@ -0,0 +1,269 @@
+import base64
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from unittest import TestCase
+
+import requests
+import requests_mock
+
+from ..pipeline import NoopRemoteAssetPipeline
+
+
+FILE_PATH = '/media/model.obj'
+FILE_URL = 'http://server.test:80/media/model.obj'
+
+
+def gzip_content(content):
+    buf = BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(content)
+    return buf.getvalue()
+
+
+class FileMockServer(object):
+    """
+    Mock file server supporting byte ranges, ETags, checksums and gzip encoded responses
+    """
+    def __init__(self, content):
+        self.lock = threading.Lock()
+        self.content = content
+        self.etag = None
+        self.checksum = False
+        self.gzip = False
+        self.requests = []
+        # number of times the whole file has been sent
+        self.downloads = 0
+
+    def __call__(self, request):
+        if request.path_url != FILE_PATH:
+            return None
+        with self.lock:
+            self.requests.append((request.method, dict(request.headers)))
+        headers = {'Accept-Ranges': 'bytes', 'Content-Length': str(len(self.content))}
+        if self.checksum:
+            headers['Content-MD5'] = base64.b64encode(hashlib.md5(self.content).digest())
+        if request.method == 'HEAD':
+            return requests_mock.create_response(request, headers=headers)
+        if self.etag:
+            headers['ETag'] = self.etag
+            if request.headers.get('If-None-Match') == self.etag:
+                return requests_mock.create_response(request, status_code=304, headers=headers)
+        match = re.match(r'bytes=(\d+)-(\d+)', request.headers.get('Range', ''))
+        if match:
+            start, end = map(int, match.groups())
+            content = self.content[start:end + 1]
+            headers['Content-Length'] = str(len(content))
+            headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, end, len(self.content))
+            return requests_mock.create_response(request, status_code=206, content=content, headers=headers)
+        content = self.content
+        if self.gzip:
+            content = gzip_content(content)
+            headers['Content-Encoding'] = 'gzip'
+        headers['Content-Length'] = str(len(content))
+        with self.lock:
+            self.downloads += 1
+        return requests_mock.create_response(request, content=content, headers=headers)
+
+    def get_requests(self, header=None):
+        return [headers for method, headers in self.requests if header is None or header in headers]
+
+
+class DownloadingPipeline(NoopRemoteAssetPipeline):
+    """
+    Pipeline downloading its files from a mock file server
+    """
+    def __init__(self, server, config=None, *args, **kwargs):
+        self.server = server
+        config = dict({'host': 'server.test', 'port': 80, 'ssl': False}, **(config or {}))
+        super(DownloadingPipeline, self).__init__(config=config, *args, **kwargs)
+        self.progress_reporter.stop()
+
+    def create_client(self, config):
+        client = requests.Session()
+        # remove standard http and https adapters
+        client.adapters = OrderedDict()
+        adapter = requests_mock.Adapter()
+        adapter.add_matcher(self.server)
+        client.mount('http', adapter)
+        return client
+
+
+class LegacyDownloadingPipeline(DownloadingPipeline):
+    """
+    Pipeline overriding download_file with its signature from before it took a progress_callback
+    """
+    def download_file(self, _path, folder):
+        self.downloaded = _path
+        return super(LegacyDownloadingPipeline, self).download_file(_path, folder)
+
+
+class TestDownloads(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.content = os.urandom(10000)
+        self.server = FileMockServer(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def download(self, pipeline, folder='original', progress_callback=None):
+        folder = os.path.join(self.directory, folder)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        outfile_path = pipeline.download_file(FILE_PATH, folder, progress_callback)
+        with open(outfile_path, 'rb') as f:
+            return f.read()
+
+    def test_buffered_download(self):
+        """
+        Writes the file through the download buffer, reporting the progress
+        :return:
+        """
+        pipeline = DownloadingPipeline(self.server, config={'download_buffer_size': '1000'})
+        progress = []
+        self.assertEquals(self.download(pipeline, progress_callback=lambda *args: progress.append(args)), self.content)
+        self.assertEquals(progress[-1], (10000, 10000))
+
+    def test_gzip_encoded_download(self):
+        """
+        Writes the decoded file if the server sent it gzip encoded, even though it decodes to more data than fits
+        into the download buffer
+        :return:
+        """
+        self.server.content = b'v 0 0 0\n' * 10000
+        self.server.gzip = True
+        pipeline = DownloadingPipeline(self.server, config={'download_buffer_size': '1000'})
+        self.assertEquals(self.download(pipeline), self.server.content)
+
+    def test_parallel_download(self):
+        """
+        Downloads large files in byte ranges in parallel
+        :return:
+        """
+        pipeline = DownloadingPipeline(self.server, config={
+            'download_buffer_size': '1000', 'parallel_downloads': '3', 'parallel_download_min_size': '5000'
+        })
+        progress = []
+        self.assertEquals(self.download(pipeline, progress_callback=lambda *args: progress.append(args)), self.content)
+        ranges = sorted(headers['Range'] for headers in self.server.get_requests('Range'))
+        self.assertEquals(ranges, ['bytes=0-3333', 'bytes=3334-6667', 'bytes=6668-9999'])
+        self.assertEquals(progress[-1], (10000, 10000))
+
+    def test_download_progress(self):
+        """
+        Reports the progress of the input file's download
+        :return:
+        """
+        pipeline = DownloadingPipeline(self.server, config={'working_directory_path': self.directory})
+        progress = []
+        pipeline.report_progress = lambda asset_data, *args: progress.append(args)
+        asset_data = pipeline.pre_execute({'id': 1, 'upload': {'file': FILE_PATH}})
+        with open(asset_data['input']['path'], 'rb') as f:
+            self.assertEquals(f.read(), self.content)
+        self.assertEquals(progress[-1], (1.0, 'download'))
+
+    def test_legacy_download_file_override(self):
+        """
+        Still calls overrides of download_file which don't take a progress_callback
+        :return:
+        """
+        pipeline = LegacyDownloadingPipeline(self.server, config={'working_directory_path': self.directory})
+        asset_data = pipeline.pre_execute({'id': 1, 'upload': {'file': FILE_PATH}})
+        self.assertEquals(pipeline.downloaded, FILE_PATH)
+        with open(asset_data['input']['path'], 'rb') as f:
+            self.assertEquals(f.read(), self.content)
+
+
+class TestDownloadCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.content = os.urandom(10000)
+        self.server = FileMockServer(self.content)
+        self.server.etag = '"1"'
+        self.pipeline = DownloadingPipeline(self.server, config={
+            'download_cache_size': '15000', 'download_cache_path': os.path.join(self.directory, 'download_cache')
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def download(self, job_id):
+        folder = os.path.join(self.directory, str(job_id))
+        os.makedirs(folder)
+        outfile_path = self.pipeline.download_file(FILE_PATH, folder)
+        with open(outfile_path, 'rb') as f:
+            return outfile_path, f.read()
+
+    def test_hit(self):
+        """
+        Takes unchanged files from the cache, as independent files which the jobs may modify
+        :return:
+        """
+        self.download(1)
+        outfile_path, content = self.download(2)
+        self.assertEquals(content, self.content)
+        self.assertEquals(self.server.downloads, 1)
+        self.assertEquals(self.server.get_requests('If-None-Match')[-1]['If-None-Match'], '"1"')
+        with open(outfile_path, 'wb') as f:
+            f.write('modified')
+        self.assertEquals(self.download(3)[1], self.content)
+        self.assertEquals(self.server.downloads, 1)
+
+    def test_hit_by_checksum(self):
+        """
+        Checks the checksum of files cached without an ETag before downloading them
+        :return:
+        """
+        self.server.etag = None
+        self.server.checksum = True
+        self.download(1)
+        self.assertEquals(self.download(2)[1], self.content)
+        self.assertEquals(self.server.downloads, 1)
+        self.assertEquals([method for method, _ in self.server.requests], ['GET', 'HEAD'])
+
+    def test_miss(self):
+        """
+        Downloads files which haven't been cached (or can't be identified)
+        :return:
+        """
+        self.server.etag = None
+        self.download(1)
+        self.assertEquals(self.download(2)[1], self.content)
+        self.assertEquals(self.server.downloads, 2)
+
+    def test_changed_validator(self):
+        """
+        Downloads files again which changed on the server
+        :return:
+        """
+        self.download(1)
+        self.server.content = os.urandom(10000)
+        self.server.etag = '"2"'
+        self.assertEquals(self.download(2)[1], self.server.content)
+        self.assertEquals(self.server.downloads, 2)
+
+    def test_eviction(self):
+        """
+        Evicts the least recently used files once the cache is full
+        :return:
+        """
+        self.download(1)
+        cache_folder = os.path.join(self.directory, 'download_cache')
+        for name in os.listdir(cache_folder):
+            os.utime(os.path.join(cache_folder, name), (0, 0))
+        self.server.content = os.urandom(10000)
+        self.server.etag = '"2"'
+        self.download(2)
+        self.assertEquals(len(os.listdir(cache_folder)), 1)
+        # the first version is no longer cached
+        self.server.content = self.content
+        self.server.etag = '"1"'
+        self.assertEquals(self.download(3)[1], self.content)
+        self.assertEquals(self.server.downloads, 3)
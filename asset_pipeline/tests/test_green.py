@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+from unittest import TestCase, skipIf
+
+import requests
+
+from ..green import GreenRemoteAssetPipeline, gevent
+from ..protocol import MessageType
+from .test_pipeline import MockSocket, get_start_message
+
+
+class GreenPipeline(GreenRemoteAssetPipeline):
+    """
+    Green pipeline which doesn't connect anywhere and keeps track of the executions running at the same time
+    """
+    supported_filetypes = ['.obj']
+
+    def __init__(self, config=None, *args, **kwargs):
+        self.lock = threading.Lock()
+        self.executions = 0
+        self.max_executions = 0
+        config = dict({'host': 'server.test', 'port': 80, 'ssl': False}, **(config or {}))
+        super(GreenPipeline, self).__init__(config=config, *args, **kwargs)
+        self.socket = MockSocket()
+        self.progress_reporter.stop()
+
+    def create_client(self, config):
+        return requests.Session()
+
+    def pre_execute(self, asset_data):
+        return asset_data
+
+    def execute(self, asset_data):
+        with self.lock:
+            self.executions += 1
+            self.max_executions = max(self.max_executions, self.executions)
+        # executions are run in real threads, so blocking them doesn't block the other jobs
+        time.sleep(0.05)
+        with self.lock:
+            self.executions -= 1
+        return asset_data
+
+    def post_execute(self, asset_data):
+        return asset_data
+
+
+@skipIf(gevent is None, 'gevent is not installed')
+class TestGreenPipeline(TestCase):
+    def run_jobs(self, pipeline, asset_ids):
+        pipeline.on_socket_open(pipeline.socket)
+        for asset_id in asset_ids:
+            pipeline.on_socket_message(pipeline.socket, get_start_message(asset_id))
+        pipeline.job_pool.join()
+        return sorted(message['id'] for message in pipeline.socket.get_messages(MessageType.CONVERSION_SUCCESS))
+
+    def test_jobs_are_run_in_greenlets(self):
+        """
+        Runs every job in a greenlet of the job pool and reports its result
+        :return:
+        """
+        pipeline = GreenPipeline()
+        self.assertIsInstance(pipeline.job_pool, gevent.pool.Pool)
+        self.assertEquals(self.run_jobs(pipeline, range(1, 6)), range(1, 6))
+        self.assertEquals(pipeline.active_jobs, 0)
+
+    def test_execution_pool_limit(self):
+        """
+        Runs at most max_concurrent_executions execute steps at the same time
+        :return:
+        """
+        pipeline = GreenPipeline(config={'max_concurrent_executions': '2'})
+        self.assertEquals(self.run_jobs(pipeline, range(1, 9)), range(1, 9))
+        self.assertEquals(pipeline.max_executions, 2)
+
+    def test_unsupported_assets_are_ignored(self):
+        """
+        Doesn't start jobs for unsupported assets
+        :return:
+        """
+        pipeline = GreenPipeline()
+        pipeline.on_socket_message(pipeline.socket, json.dumps({
+            'type': MessageType.CONVERSION_START, 'data': {'id': 1, 'upload': {'file': '/media/model.fbx'}}
+        }))
+        pipeline.job_pool.join()
+        self.assertEquals(pipeline.socket.get_messages(MessageType.CONVERSION_SUCCESS), [])
@@ -0,0 +1,902 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+from unittest import TestCase
+
+import requests
+import requests_mock
+
+from ..pipeline import AbstractAssetPipeline, NoopRemoteAssetPipeline, PlatformSpecificAssetPipelineMixin
+from ..materialize import COPY, HARDLINK, REFLINK, materialize_file
+from ..progress import ProgressReporter
+from ..result_cache import get_folder_size
+from ..protocol import MessageType
+from ..scheduler import StagedScheduler
+from ..streaming import InputStream
+from ..working_directories import WorkingDirectoryFullError, WorkingDirectoryManager
+
+
+class LocalPipeline(AbstractAssetPipeline):
+    """
+    Pipeline which doesn't need any connection, only recording where its steps were run
+    """
+    def validate_configuration(self, config):
+        return True
+
+    def pre_execute(self, asset_data):
+        asset_data['pre_execute_pid'] = os.getpid()
+
+    def execute(self, asset_data):
+        asset_data['execute_pid'] = os.getpid()
+        return asset_data
+
+    def post_execute(self, asset_data):
+        asset_data['post_execute_pid'] = os.getpid()
+
+
+class TestExecuteProcesses(TestCase):
+    def setUp(self):
+        self.pipeline = LocalPipeline(config={'execute_processes': '2'})
+
+    def tearDown(self):
+        self.pipeline.close_execute_pool()
+
+    def test_execute_in_worker_process(self):
+        """
+        Runs execute in a worker process, but the hooks in the current one
+        :return:
+        """
+        asset_data = {'id': 1}
+        self.pipeline.run(asset_data)
+        self.assertEquals(asset_data['pre_execute_pid'], os.getpid())
+        self.assertEquals(asset_data['post_execute_pid'], os.getpid())
+        self.assertNotEquals(asset_data['execute_pid'], os.getpid())
+
+    def test_worker_processes_are_reused(self):
+        """
+        Keeps the worker processes running across jobs
+        :return:
+        """
+        pids = set()
+        for asset_id in range(6):
+            asset_data = {'id': asset_id}
+            self.pipeline.run(asset_data)
+            pids.add(asset_data['execute_pid'])
+        self.assertLessEqual(len(pids), 2)
+
+
+class TestStagedScheduler(TestCase):
+    def test_stages_overlap(self):
+        """
+        Runs the first stage of the next job while the previous job is in the second stage
+        :return:
+        """
+        downloaded = set()
+        events = []
+
+        def download(asset_data):
+            downloaded.add(asset_data['id'])
+            events.append(('download', asset_data['id']))
+
+        def convert(asset_data):
+            if asset_data['id'] == 1:
+                # the second job has to be downloaded while the first is being converted
+                while 2 not in downloaded:
+                    time.sleep(0.01)
+            events.append(('convert', asset_data['id']))
+
+        scheduler = StagedScheduler([('download', download, 1), ('convert', convert, 1)])
+        jobs = [scheduler.submit({'id': asset_id}) for asset_id in (1, 2)]
+        for job in jobs:
+            job.get(timeout=5)
+        scheduler.close()
+        scheduler.join(timeout=5)
+        self.assertEquals(events, [('download', 1), ('download', 2), ('convert', 1), ('convert', 2)])
+
+    def test_failed_stage(self):
+        """
+        Skips the remaining stages of a failed job and reports its error
+        :return:
+        """
+        done = []
+
+        def fail(asset_data):
+            raise ValueError('conversion failed')
+
+        def upload(asset_data):
+            asset_data['uploaded'] = True
+
+        scheduler = StagedScheduler(
+            [('convert', fail, 1), ('upload', upload, 1)], on_done=lambda asset_data, error: done.append(error)
+        )
+        job = scheduler.submit({'id': 1})
+        with self.assertRaises(ValueError):
+            job.get(timeout=5)
+        self.assertNotIn('uploaded', job.asset_data)
+        self.assertIsInstance(done[0], ValueError)
+        scheduler.close()
+
+
+class TestProgressReporter(TestCase):
+    def test_updates_are_coalesced(self):
+        """
+        Sends only the most recent progress update of a job per interval
+        :return:
+        """
+        sent = []
+        reporter = ProgressReporter(sent.append, interval=0.2)
+        for step in range(1000):
+            reporter.report(1, step / 1000.0, 'execute')
+        reporter.report(2, 0.5, 'download')
+        time.sleep(0.3)
+        reporter.stop()
+        self.assertEquals(sorted(sent), [
+            {'id': 1, 'progress': 0.999, 'stage': 'execute'},
+            {'id': 2, 'progress': 0.5, 'stage': 'download'}
+        ])
+
+    def test_finished_jobs_are_dropped(self):
+        """
+        Doesn't send pending updates of jobs which are done already
+        :return:
+        """
+        sent = []
+        reporter = ProgressReporter(sent.append, interval=0.1)
+        reporter.report(1, 0.5)
+        reporter.finish(1)
+        time.sleep(0.2)
+        reporter.stop()
+        self.assertEquals(sent, [])
+
+
+class MockSocket(object):
+    """
+    Stands in for the websocket connection, recording all messages sent on it
+    """
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append(json.loads(message))
+
+    def get_messages(self, msg_type):
+        return [message['data'] for message in self.messages if message['type'] == msg_type]
+
+
+class RemotePipeline(NoopRemoteAssetPipeline):
+    """
+    Remote pipeline which doesn't connect anywhere and blocks its jobs until they're released
+    """
+    supported_filetypes = ['.obj']
+
+    def __init__(self, config=None, *args, **kwargs):
+        self.release = threading.Event()
+        config = dict({'host': 'server.test', 'port': 80, 'ssl': False}, **(config or {}))
+        super(RemotePipeline, self).__init__(config=config, *args, **kwargs)
+        self.socket = MockSocket()
+
+    def create_client(self, config):
+        return requests.Session()
+
+    def run(self, asset_data):
+        self.release.wait(5)
+
+
+def get_start_message(asset_id):
+    return json.dumps({
+        'type': MessageType.CONVERSION_START,
+        'data': {'id': asset_id, 'upload': {'file': '/media/model%s.obj' % asset_id}}
+    })
+
+
+class ProcessPipeline(RemotePipeline):
+    """
+    Remote pipeline reporting progress from within the execute_processes
+    """
+    def execute(self, asset_data):
+        asset_data['execute_pid'] = os.getpid()
+        self.report_progress(asset_data, 0.5, 'execute')
+        return asset_data
+
+
+class PlatformProcessPipeline(PlatformSpecificAssetPipelineMixin, ProcessPipeline):
+    """
+    Platform specific pipeline executing in worker processes, which relies on its platform in execute
+    """
+    def retrieve_platform_by_slug(self, slug):
+        return {'id': 3, 'slug': slug}
+
+    def execute(self, asset_data):
+        asset_data['platform'] = self.platform
+        return super(PlatformProcessPipeline, self).execute(asset_data)
+
+
+class TestRemoteExecuteProcesses(TestCase):
+    def setUp(self):
+        self.pipeline = ProcessPipeline(config={'execute_processes': '1', 'progress_interval': '0.01'})
+        self.pipeline.on_socket_open(self.pipeline.socket)
+
+    def tearDown(self):
+        self.pipeline.progress_reporter.stop()
+        self.pipeline.close_execute_pool()
+
+    def test_processes_are_forked_once_the_pipeline_starts(self):
+        """
+        Starts the worker processes once the pipeline (including its subclasses) is set up completely, so execute
+        sees e.g. the platform of platform specific pipelines
+        :return:
+        """
+        pipeline = PlatformProcessPipeline(config={'execute_processes': '1', 'platform_slug': 'web'})
+        self.addCleanup(pipeline.close_execute_pool)
+        pipeline.progress_reporter.stop()
+        self.assertIsNone(pipeline.execute_pool)
+        # don't connect anywhere
+        pipeline.stopping.set()
+        pipeline.start()
+        self.assertIsNotNone(pipeline.execute_pool)
+        asset_data = {'id': 1}
+        pipeline.dispatch_execute(asset_data)
+        self.assertNotEquals(asset_data['execute_pid'], os.getpid())
+        self.assertEquals(asset_data['platform'], {'id': 3, 'slug': 'web'})
+
+    def test_progress_reported_by_worker_processes(self):
+        """
+        Reports the progress reported from within the worker processes
+        :return:
+        """
+        self.pipeline.dispatch_execute({'id': 1})
+        deadline = time.time() + 5
+        while not self.pipeline.socket.get_messages(MessageType.CONVERSION_PROGRESS) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEquals(
+            self.pipeline.socket.get_messages(MessageType.CONVERSION_PROGRESS),
+            [{'id': 1, 'progress': 0.5, 'stage': 'execute'}]
+        )
+
+
+class TestCapacity(TestCase):
+    def setUp(self):
+        self.pipeline = RemotePipeline(config={'max_concurrent_jobs': '1', 'max_queued_jobs': '1'})
+        self.pipeline.on_socket_open(self.pipeline.socket)
+
+    def tearDown(self):
+        self.pipeline.release.set()
+        self.pipeline.progress_reporter.stop()
+
+    def test_capacity_on_connect(self):
+        """
+        Advertises the free worker slots and disk space as soon as the connection is opened
+        :return:
+        """
+        capacity = self.pipeline.socket.get_messages(MessageType.PIPELINE_CAPACITY)[0]
+        self.assertEquals(capacity['free_slots'], 1)
+        self.assertEquals(capacity['credits'], 2)
+        self.assertGreater(capacity['free_disk_space'], 0)
+
+    def test_reject_when_queue_is_full(self):
+        """
+        Rejects jobs once all workers are busy and the local queue is full, and advertises the freed capacity
+        once the jobs are done
+        :return:
+        """
+        for asset_id in (1, 2, 3):
+            self.pipeline.on_socket_message(self.pipeline.socket, get_start_message(asset_id))
+        rejected = self.pipeline.socket.get_messages(MessageType.CONVERSION_REJECTED)
+        self.assertEquals([message['id'] for message in rejected], [3])
+        self.assertEquals(rejected[0]['capacity']['credits'], 0)
+        self.pipeline.release.set()
+        self.pipeline.job_pool.close()
+        self.pipeline.job_pool.join()
+        capacity = self.pipeline.socket.get_messages(MessageType.PIPELINE_CAPACITY)
+        self.assertEquals(len(capacity), 3)
+        self.assertEquals(capacity[-1]['credits'], 2)
+
+
+class FailingPipeline(RemotePipeline):
+    """
+    Remote pipeline whose jobs fail for odd asset ids
+    """
+    def run(self, asset_data):
+        self.release.wait(5)
+        if asset_data['id'] % 2:
+            raise ValueError('Conversion failed')
+
+
+class TestConcurrentJobs(TestCase):
+    def setUp(self):
+        self.pipeline = FailingPipeline(config={'max_concurrent_jobs': '4', 'max_queued_jobs': '4'})
+        self.pipeline.on_socket_open(self.pipeline.socket)
+
+    def tearDown(self):
+        self.pipeline.release.set()
+        self.pipeline.progress_reporter.stop()
+
+    def test_failed_jobs_are_accounted_for(self):
+        """
+        Counts the jobs running at the same time, including the failing ones, and frees their slots once they're done
+        :return:
+        """
+        for asset_id in range(1, 9):
+            self.pipeline.on_socket_message(self.pipeline.socket, get_start_message(asset_id))
+        self.assertEquals(self.pipeline.active_jobs, 8)
+        self.assertEquals(self.pipeline.get_capacity()['credits'], 0)
+        self.pipeline.release.set()
+        self.pipeline.job_pool.close()
+        self.pipeline.job_pool.join()
+        self.assertEquals(self.pipeline.active_jobs, 0)
+        succeeded = self.pipeline.socket.get_messages(MessageType.CONVERSION_SUCCESS)
+        failed = self.pipeline.socket.get_messages(MessageType.CONVERSION_FAIL)
+        self.assertEquals(sorted(message['id'] for message in succeeded), [2, 4, 6, 8])
+        self.assertEquals(sorted(message['id'] for message in failed), [1, 3, 5, 7])
+        self.assertEquals(self.pipeline.get_capacity()['credits'], 8)
+
+
+class TestReconnect(TestCase):
+    def setUp(self):
+        self.pipeline = RemotePipeline(config={'reconnect_min_delay': '1', 'reconnect_max_delay': '10'})
+        self.pipeline.on_socket_open(self.pipeline.socket)
+
+    def tearDown(self):
+        self.pipeline.release.set()
+        self.pipeline.progress_reporter.stop()
+
+    def test_results_are_sent_after_reconnect(self):
+        """
+        Keeps running jobs while disconnected and reports their results once connected again
+        :return:
+        """
+        self.pipeline.on_socket_message(self.pipeline.socket, get_start_message(1))
+        self.pipeline.on_socket_close(self.pipeline.socket)
+        self.pipeline.release.set()
+        self.pipeline.job_pool.close()
+        self.pipeline.job_pool.join()
+        self.assertEquals(self.pipeline.socket.get_messages(MessageType.CONVERSION_SUCCESS), [])
+        # reconnect
+        self.pipeline.socket = MockSocket()
+        self.pipeline.on_socket_open(self.pipeline.socket)
+        self.assertEquals(self.pipeline.socket.get_messages(MessageType.CONVERSION_SUCCESS), [{'id': 1}])
+        self.assertEquals(self.pipeline.outbox, [])
+
+    def test_reconnect_delay(self):
+        """
+        Backs off exponentially (with jitter) up to the maximum delay
+        :return:
+        """
+        for attempt in range(10):
+            delay = self.pipeline.get_reconnect_delay(attempt)
+            self.assertLessEqual(delay, min(10, 2 ** attempt))
+            self.assertGreaterEqual(delay, 0)
+
+
+class TestMessageDispatch(TestCase):
+    def setUp(self):
+        self.pipeline = RemotePipeline()
+        self.pipeline.on_socket_open(self.pipeline.socket)
+
+    def tearDown(self):
+        self.pipeline.release.set()
+        self.pipeline.progress_reporter.stop()
+
+    def test_batched_messages(self):
+        """
+        Dispatches every message of a batch
+        :return:
+        """
+        submitted = []
+        self.pipeline.submit_job = submitted.append
+        batch = '[%s, %s]' % (get_start_message(1), get_start_message(2))
+        self.pipeline.on_socket_message(self.pipeline.socket, batch)
+        self.assertEquals([asset_data['id'] for asset_data in submitted], [1, 2])
+
+    def test_registered_handler(self):
+        """
+        Dispatches messages to the handler registered for their type and ignores unknown or invalid messages
+        :return:
+        """
+        received = []
+        self.pipeline.register_message_handler('HEARTBEAT', received.append)
+        self.pipeline.on_socket_message(self.pipeline.socket, json.dumps({'type': 'HEARTBEAT', 'data': 1}))
+        self.pipeline.on_socket_message(self.pipeline.socket, json.dumps({'type': 'UNKNOWN'}))
+        self.pipeline.on_socket_message(self.pipeline.socket, 'no json')
+        self.assertEquals(received, [{'type': 'HEARTBEAT', 'data': 1}])
+
+
+class TestDuplicateJobs(TestCase):
+    def setUp(self):
+        self.pipeline = RemotePipeline(config={'max_concurrent_jobs': '2'})
+        self.pipeline.on_socket_open(self.pipeline.socket)
+        self.runs = []
+        run = self.pipeline.run
+
+        def counting_run(asset_data):
+            self.runs.append(asset_data['id'])
+            run(asset_data)
+        self.pipeline.run = counting_run
+
+    def tearDown(self):
+        self.pipeline.release.set()
+        self.pipeline.progress_reporter.stop()
+
+    def wait_for_jobs(self):
+        self.pipeline.release.set()
+        self.pipeline.job_pool.close()
+        self.pipeline.job_pool.join()
+
+    def test_duplicate_of_running_job(self):
+        """
+        Attaches a re-sent CONVERSION_START to the running job instead of running it again
+        :return:
+        """
+        self.pipeline.on_socket_message(self.pipeline.socket, get_start_message(1))
+        self.pipeline.on_socket_message(self.pipeline.socket, get_start_message(1))
+        self.wait_for_jobs()
+        self.assertEquals(self.runs, [1])
+        self.assertEquals(self.pipeline.socket.get_messages(MessageType.CONVERSION_SUCCESS), [{'id': 1}])
+
+    def test_duplicate_of_finished_job(self):
+        """
+        Reports the result of a recently finished job again instead of running it again
+        :return:
+        """
+        self.pipeline.on_socket_message(self.pipeline.socket, get_start_message(1))
+        self.wait_for_jobs()
+        self.pipeline.on_socket_message(self.pipeline.socket, get_start_message(1))
+        self.assertEquals(self.runs, [1])
+        self.assertEquals(self.pipeline.socket.get_messages(MessageType.CONVERSION_SUCCESS), [{'id': 1}, {'id': 1}])
+
+    def test_finished_jobs_expire(self):
+        """
+        Runs the job again once its result has been forgotten
+        :return:
+        """
+        self.pipeline.job_registry.finished_ttl = 0
+        self.pipeline.on_socket_message(self.pipeline.socket, get_start_message(1))
+        self.wait_for_jobs()
+        self.pipeline.job_pool = self.pipeline.create_job_pool()
+        self.pipeline.on_socket_message(self.pipeline.socket, get_start_message(1))
+        self.wait_for_jobs()
+        self.assertEquals(self.runs, [1, 1])
+
+    def test_failed_job_is_run_again(self):
+        """
+        Runs a failed job again right away instead of reporting its failure again
+        :return:
+        """
+        def failing_run(asset_data):
+            self.runs.append(asset_data['id'])
+            raise IOError('Download failed')
+        self.pipeline.run = failing_run
+        self.pipeline.on_socket_message(self.pipeline.socket, get_start_message(1))
+        self.wait_for_jobs()
+        self.pipeline.job_pool = self.pipeline.create_job_pool()
+        self.pipeline.on_socket_message(self.pipeline.socket, get_start_message(1))
+        self.wait_for_jobs()
+        self.assertEquals(self.runs, [1, 1])
+        self.assertEquals(len(self.pipeline.socket.get_messages(MessageType.CONVERSION_FAIL)), 2)
+
+
+class ConvertingPipeline(AbstractAssetPipeline):
+    """
+    Pipeline "converting" its input file by upper-casing it
+    """
+    def __init__(self, config=None, *args, **kwargs):
+        super(ConvertingPipeline, self).__init__(config=config, *args, **kwargs)
+        self.executions = 0
+
+    def validate_configuration(self, config):
+        return True
+
+    def pre_execute(self, asset_data):
+        pass
+
+    def execute(self, asset_data):
+        self.executions += 1
+        with open(asset_data['input']['path']) as f:
+            content = f.read()
+        asset_data['output']['file'] = os.path.join(asset_data['output']['path'], 'converted.txt')
+        asset_data['converted_length'] = len(content)
+        with open(asset_data['output']['file'], 'w') as f:
+            f.write(content.upper())
+        return asset_data
+
+    def post_execute(self, asset_data):
+        # e.g. uploading the converted file
+        with open(asset_data['output']['file']) as f:
+            self.uploaded = f.read(), asset_data['converted_length']
+
+
+class TestResultCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = {'result_cache_size': str(1 << 20), 'result_cache_path': os.path.join(self.directory, 'cache')}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def convert(self, pipeline, asset_id, content):
+        job_directory = os.path.join(self.directory, str(asset_id))
+        os.makedirs(os.path.join(job_directory, 'converted'))
+        input_path = os.path.join(job_directory, 'model.txt')
+        with open(input_path, 'w') as f:
+            f.write(content)
+        pipeline.run({'id': asset_id, 'input': {'path': input_path},
+                      'output': {'path': os.path.join(job_directory, 'converted')}})
+        with open(os.path.join(job_directory, 'converted', 'converted.txt')) as f:
+            return f.read()
+
+    def test_unchanged_input_is_restored(self):
+        """
+        Restores the cached output of an unchanged input file instead of converting it again
+        :return:
+        """
+        pipeline = ConvertingPipeline(config=self.config)
+        self.assertEquals(self.convert(pipeline, 1, 'model'), 'MODEL')
+        self.assertEquals(self.convert(pipeline, 2, 'model'), 'MODEL')
+        self.assertEquals(pipeline.executions, 1)
+        self.assertEquals(self.convert(pipeline, 3, 'other model'), 'OTHER MODEL')
+        self.assertEquals(pipeline.executions, 2)
+
+    def test_settings_and_version_are_part_of_the_key(self):
+        """
+        Converts the file again with different settings or another version of the pipeline, but not because of
+        different connection settings
+        :return:
+        """
+        self.convert(ConvertingPipeline(config=self.config), 1, 'model')
+        pipeline = ConvertingPipeline(config=dict(
+            self.config, host='other.test', working_directory_budget='1000000', stream_input_to_disk='true'
+        ))
+        self.convert(pipeline, 2, 'model')
+        self.assertEquals(pipeline.executions, 0)
+        pipeline = ConvertingPipeline(config=dict(self.config, quality='high'))
+        self.convert(pipeline, 3, 'model')
+        self.assertEquals(pipeline.executions, 1)
+        pipeline = ConvertingPipeline(config=self.config)
+        pipeline.version = 2
+        self.convert(pipeline, 4, 'model')
+        self.assertEquals(pipeline.executions, 1)
+
+    def test_changes_to_asset_data_are_restored(self):
+        """
+        Restores the changes execute made to asset_data along with the output, pointing to the job's output folder
+        :return:
+        """
+        pipeline = ConvertingPipeline(config=self.config)
+        self.convert(pipeline, 1, 'model')
+        self.convert(pipeline, 2, 'model')
+        self.assertEquals(pipeline.executions, 1)
+        self.assertEquals(pipeline.uploaded, ('MODEL', 5))
+        # the restored output file is the one of the second job, which may be modified independently
+        shutil.rmtree(os.path.join(self.directory, '1'))
+        self.convert(pipeline, 3, 'model')
+        self.assertEquals(pipeline.uploaded, ('MODEL', 5))
+
+    def test_cached_result_is_independent_of_the_output(self):
+        """
+        Keeps the cached result unchanged if the output it has been stored from (or restored to) is modified
+        :return:
+        """
+        pipeline = ConvertingPipeline(config=self.config)
+        self.convert(pipeline, 1, 'model')
+        with open(os.path.join(self.directory, '1', 'converted', 'converted.txt'), 'w') as f:
+            f.write('overwritten')
+        self.assertEquals(self.convert(pipeline, 2, 'model'), 'MODEL')
+        with open(os.path.join(self.directory, '2', 'converted', 'converted.txt'), 'w') as f:
+            f.write('overwritten')
+        self.assertEquals(self.convert(pipeline, 3, 'model'), 'MODEL')
+        self.assertEquals(pipeline.executions, 1)
+
+
+class TestMaterialize(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source_folder = os.path.join(self.directory, 'original')
+        os.makedirs(os.path.join(self.source_folder, 'textures'))
+        for name in ('model.obj', os.path.join('textures', 'diffuse.png')):
+            with open(os.path.join(self.source_folder, name), 'w') as f:
+                f.write(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_noop_pipeline(self):
+        """
+        Materializes all of the input file's folder in the output folder
+        :return:
+        """
+        pipeline = RemotePipeline()
+        output_folder = os.path.join(self.directory, 'converted')
+        pipeline.execute({
+            'input': {'path': os.path.join(self.source_folder, 'model.obj')}, 'output': {'path': output_folder}
+        })
+        pipeline.progress_reporter.stop()
+        for name in ('model.obj', os.path.join('textures', 'diffuse.png')):
+            with open(os.path.join(output_folder, name)) as f:
+                self.assertEquals(f.read(), name)
+        # rewriting the output leaves the input untouched
+        with open(os.path.join(output_folder, 'model.obj'), 'w') as f:
+            f.write('modified')
+        with open(os.path.join(self.source_folder, 'model.obj')) as f:
+            self.assertEquals(f.read(), 'model.obj')
+
+    def test_no_hardlinks_by_default(self):
+        """
+        Provides an independent file unless hardlinks are allowed explicitly
+        :return:
+        """
+        source_path = os.path.join(self.source_folder, 'model.obj')
+        target_path = os.path.join(self.directory, 'model.obj')
+        self.assertIn(materialize_file(source_path, target_path), (REFLINK, COPY))
+        with open(target_path, 'w') as f:
+            f.write('modified')
+        with open(source_path) as f:
+            self.assertEquals(f.read(), 'model.obj')
+        self.assertIn(materialize_file(source_path, target_path, allow_hardlink=True), (REFLINK, HARDLINK))
+
+    def test_without_hardlinks(self):
+        """
+        Provides an independent file if it must not be hardlinked
+        :return:
+        """
+        source_path = os.path.join(self.source_folder, 'model.obj')
+        target_path = os.path.join(self.directory, 'model.obj')
+        self.assertIn(materialize_file(source_path, target_path, allow_hardlink=False), (REFLINK, COPY))
+        with open(target_path, 'w') as f:
+            f.write('modified')
+        with open(source_path) as f:
+            self.assertEquals(f.read(), 'model.obj')
+
+
+class TestWorkingDirectories(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fill(self, manager, job_id, size):
+        directory = manager.acquire(job_id, size)
+        os.makedirs(os.path.join(directory, 'original'))
+        with open(os.path.join(directory, 'original', 'model.obj'), 'wb') as f:
+            f.write('\0' * size)
+        return directory
+
+    def test_least_recently_used_directories_are_removed(self):
+        """
+        Removes the directories of the least recently finished jobs once the budget is exceeded
+        :return:
+        """
+        manager = WorkingDirectoryManager(self.directory, budget=2500, timeout=0)
+        for job_id in (1, 2):
+            self.fill(manager, job_id, 1000)
+            manager.release(job_id)
+        self.fill(manager, 3, 1000)
+        self.assertFalse(os.path.exists(manager.get_path(1)))
+        self.assertTrue(os.path.exists(manager.get_path(2)))
+        self.assertEquals(manager.get_usage(), 2000)
+
+    def test_refuse_when_out_of_space(self):
+        """
+        Refuses jobs which don't fit into the budget next to the running ones
+        :return:
+        """
+        manager = WorkingDirectoryManager(self.directory, budget=1500, timeout=0)
+        self.fill(manager, 1, 1000)
+        self.assertFalse(manager.has_space(1000))
+        with self.assertRaises(WorkingDirectoryFullError):
+            manager.acquire(2, 1000)
+
+    def test_running_jobs_are_accounted_for_by_their_expected_size(self):
+        """
+        Reserves the expected size for running jobs, until their directories are measured once they're done
+        :return:
+        """
+        manager = WorkingDirectoryManager(self.directory, budget=1500, timeout=0)
+        manager.acquire(1, 1000)
+        self.assertEquals(manager.get_usage(), 1000)
+        self.assertFalse(manager.has_space(1000))
+        manager.release(1)
+        self.assertEquals(manager.get_usage(), 0)
+        self.assertTrue(manager.has_space(1000))
+
+    def test_release_after_failed_acquire(self):
+        """
+        Ignores releasing a directory which couldn't be acquired, so the usage doesn't drift
+        :return:
+        """
+        manager = WorkingDirectoryManager(self.directory, budget=1500, timeout=0)
+        self.fill(manager, 1, 1000)
+        manager.release(1)
+        self.fill(manager, 2, 400)
+        with self.assertRaises(WorkingDirectoryFullError):
+            manager.acquire(1, 1200)
+        manager.release(1)
+        self.assertTrue(os.path.exists(manager.get_path(1)))
+        self.assertEquals(manager.get_usage(), 1400)
+        manager.release(2)
+        self.fill(manager, 3, 100)
+        manager.release(3)
+        self.assertEquals(manager.get_usage(), get_folder_size(self.directory))
+
+    def test_failed_job_keeps_shared_directory(self):
+        """
+        Keeps the directory of a running job if another job of the same asset couldn't get it
+        :return:
+        """
+        pipeline = RemotePipeline(config={
+            'working_directory_path': self.directory, 'working_directory_budget': '1500',
+            'working_directory_timeout': '0'
+        })
+        pipeline.progress_reporter.stop()
+        pipeline.working_directories.acquire(1, 1000)
+        asset_data = {'id': 1, 'upload': {'file': '/media/other.obj', 'size': 1000}}
+        with self.assertRaises(WorkingDirectoryFullError) as context:
+            pipeline.pre_execute(asset_data)
+        pipeline.on_job_done(asset_data, context.exception)
+        self.assertEquals(pipeline.working_directories.active, {'1': 1})
+        self.assertEquals(pipeline.working_directories.get_usage(), 1000)
+
+    def test_reject_jobs_which_do_not_fit(self):
+        """
+        Rejects jobs whose input file doesn't fit into the budget
+        :return:
+        """
+        pipeline = RemotePipeline(config={
+            'working_directory_path': self.directory, 'working_directory_budget': '1500', 'max_queued_jobs': '1'
+        })
+        pipeline.on_socket_open(pipeline.socket)
+        pipeline.progress_reporter.stop()
+        pipeline.on_socket_message(pipeline.socket, json.dumps({
+            'type': MessageType.CONVERSION_START,
+            'data': {'id': 1, 'upload': {'file': '/media/model1.obj', 'size': 2000}}
+        }))
+        rejected = pipeline.socket.get_messages(MessageType.CONVERSION_REJECTED)
+        self.assertEquals([message['id'] for message in rejected], [1])
+
+    def test_wait_for_running_jobs(self):
+        """
+        Lets jobs wait for running jobs to finish if there's no space left
+        :return:
+        """
+        manager = WorkingDirectoryManager(self.directory, budget=1500, timeout=5)
+        self.fill(manager, 1, 1000)
+        threading.Timer(0.1, manager.release, (1,)).start()
+        self.fill(manager, 2, 1000)
+        self.assertFalse(os.path.exists(manager.get_path(1)))
+
+    def test_shared_directories_are_kept_while_in_use(self):
+        """
+        Keeps a directory shared by several jobs (of the same asset) until all of them are done
+        :return:
+        """
+        manager = WorkingDirectoryManager(self.directory, budget=1500, timeout=0)
+        self.fill(manager, 1, 1000)
+        manager.acquire(1, 0)
+        manager.release(1)
+        with self.assertRaises(WorkingDirectoryFullError):
+            manager.acquire(2, 1000)
+        self.assertTrue(os.path.exists(manager.get_path(1)))
+        manager.release(1)
+        self.fill(manager, 2, 1000)
+        self.assertFalse(os.path.exists(manager.get_path(1)))
+
+    def test_adopt_directories_of_earlier_runs(self):
+        """
+        Takes over the job directories left behind by earlier runs, but nothing else
+        :return:
+        """
+        self.fill(WorkingDirectoryManager(self.directory), 1, 1000)
+        os.makedirs(os.path.join(self.directory, 'download_cache'))
+        manager = WorkingDirectoryManager(self.directory, budget=1500, timeout=0)
+        self.assertEquals(manager.get_usage(), 1000)
+        self.fill(manager, 2, 1000)
+        self.assertFalse(os.path.exists(manager.get_path(1)))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'download_cache')))
+
+
+MODEL_CONTENT = 'v 0 0 0\n' * 1000
+
+
+class StreamingPipeline(NoopRemoteAssetPipeline):
+    """
+    Pipeline "converting" its input by upper-casing it while it's being downloaded from a mock server
+    """
+    supported_filetypes = ['.obj']
+    supports_streaming_input = True
+
+    def create_client(self, config):
+        client = requests.Session()
+        # remove standard http and https adapters
+        client.adapters = OrderedDict()
+        adapter = requests_mock.Adapter()
+        adapter.register_uri('GET', 'http://server.test:80/media/model.obj', content=MODEL_CONTENT)
+        adapter.register_uri('GET', 'http://server.test:80/media/missing.obj', status_code=404)
+        client.mount('http', adapter)
+        self.responses = []
+        client.hooks['response'].append(lambda response, *args, **kwargs: self.responses.append(response))
+        return client
+
+    def execute_stream(self, asset_data, stream):
+        self.chunks = 0
+        with open(os.path.join(asset_data['output']['path'], 'converted.obj'), 'wb') as f:
+            for chunk in stream:
+                self.chunks += 1
+                f.write(chunk.upper())
+        return asset_data
+
+
+class TestStreamingInput(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_pipeline(self, **config):
+        pipeline = StreamingPipeline(config=dict({
+            'host': 'server.test', 'port': 80, 'ssl': False, 'working_directory_path': self.directory,
+            'download_buffer_size': '1000'
+        }, **config))
+        pipeline.progress_reporter.stop()
+        asset_data = {'id': 1, 'upload': {'file': '/media/model.obj'}}
+        pipeline.run(asset_data)
+        with open(os.path.join(asset_data['output']['path'], 'converted.obj')) as f:
+            self.assertEquals(f.read(), MODEL_CONTENT.upper())
+        self.assertEquals(pipeline.chunks, 8)
+        return asset_data
+
+    def test_stream_without_download(self):
+        """
+        Hands the download's stream to the pipeline without writing the input file to disk
+        :return:
+        """
+        asset_data = self.run_pipeline()
+        self.assertIsNone(asset_data['input']['path'])
+        self.assertEquals(os.listdir(os.path.join(self.directory, '1', 'original')), [])
+
+    def test_stream_to_disk(self):
+        """
+        Writes the streamed input file to disk as well, if needed
+        :return:
+        """
+        asset_data = self.run_pipeline(stream_input_to_disk='true')
+        with open(asset_data['input']['path']) as f:
+            self.assertEquals(f.read(), MODEL_CONTENT)
+
+    def test_read_gzip_encoded_stream(self):
+        """
+        Reads exactly the requested number of decoded bytes from a gzip encoded response
+        :return:
+        """
+        buf = BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+            f.write(MODEL_CONTENT)
+        client = requests.Session()
+        client.adapters = OrderedDict()
+        adapter = requests_mock.Adapter()
+        adapter.register_uri('GET', 'http://server.test/media/model.obj', content=buf.getvalue(),
+                             headers={'Content-Encoding': 'gzip'})
+        client.mount('http', adapter)
+        stream = InputStream(client.get('http://server.test/media/model.obj', stream=True), buffer_size=1000)
+        pieces = list(iter(lambda: stream.read(7), b''))
+        stream.close()
+        self.assertEquals(b''.join(pieces), MODEL_CONTENT)
+        self.assertTrue(all(len(piece) == 7 for piece in pieces[:-1]))
+        self.assertEquals(len(pieces[-1]), len(MODEL_CONTENT) % 7)
+
+    def test_close_response_of_missing_file(self):
+        """
+        Releases the response if the input file can't be streamed
+        :return:
+        """
+        pipeline = StreamingPipeline(config={'host': 'server.test', 'port': 80, 'ssl': False})
+        pipeline.progress_reporter.stop()
+        with self.assertRaises(requests.HTTPError):
+            pipeline.open_input_stream({'input': {'url': 'http://server.test:80/media/missing.obj'}})
+        self.assertTrue(pipeline.responses[0].raw.closed)
@@ -0,0 +1,106 @@
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+
+import requests
+from requests.packages.urllib3.exceptions import ConnectTimeoutError
+
+from ..transport import JitteredRetry, get_pool_statistics, mount_pooled_adapters
+
+
+class FlakyRequestHandler(BaseHTTPRequestHandler):
+    """
+    Responds with 503 until the server's number of failures is used up, then with 200
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self):
+        self.server.requests.append(self.command)
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            status = 503
+        else:
+            status = 200
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+
+    do_GET = respond
+    do_POST = respond
+
+    def log_message(self, *args):
+        pass
+
+
+class TestJitteredRetry(TestCase):
+    def test_backoff_is_jittered(self):
+        """
+        Waits a random time between 0 and the exponential backoff before retrying
+        :return:
+        """
+        retry = JitteredRetry(total=5, backoff_factor=1)
+        for _ in range(3):
+            retry = retry.increment('GET', '/', error=ConnectTimeoutError())
+        backoff_times = [retry.get_backoff_time() for _ in range(100)]
+        self.assertTrue(all(0 <= backoff_time <= 4 for backoff_time in backoff_times))
+        self.assertGreater(len(set(backoff_times)), 1)
+
+
+class TestPooledAdapters(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), FlakyRequestHandler)
+        self.server.failures = 0
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{0}/'.format(self.server.server_port)
+        self.session = mount_pooled_adapters(requests.Session(), pool_maxsize=5, max_retries=3, backoff_factor=0.01)
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry_server_errors(self):
+        """
+        Retries idempotent requests which failed with a server error
+        :return:
+        """
+        self.server.failures = 2
+        self.assertEquals(self.session.get(self.url).status_code, 200)
+        self.assertEquals(self.server.requests, ['GET', 'GET', 'GET'])
+
+    def test_give_up_retrying(self):
+        """
+        Returns the last response once all retries are used up
+        :return:
+        """
+        self.server.failures = 10
+        self.assertEquals(self.session.get(self.url).status_code, 503)
+        self.assertEquals(len(self.server.requests), 4)
+
+    def test_no_retries_for_non_idempotent_requests(self):
+        """
+        Doesn't retry requests which must not be sent twice
+        :return:
+        """
+        self.server.failures = 1
+        self.assertEquals(self.session.post(self.url, data='data').status_code, 503)
+        self.assertEquals(self.server.requests, ['POST'])
+
+    def test_pool_statistics(self):
+        """
+        Reports the connections and requests per connection pool
+        :return:
+        """
+        self.server.failures = 1
+        for _ in range(2):
+            self.session.get(self.url)
+        statistics = get_pool_statistics(self.session)
+        self.assertEquals(statistics.keys(), ['http://127.0.0.1:{0}'.format(self.server.server_port)])
+        pool = statistics.values()[0]
+        self.assertEquals(pool['max_connections'], 5)
+        self.assertEquals(pool['requests'], 3)
+        self.assertEquals(pool['connections_created'], 1)
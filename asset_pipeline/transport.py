@@ -0,0 +1,63 @@
+import random
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+# server errors which are worth retrying an idempotent request for
+RETRY_STATUS_CODES = (502, 503, 504)
+
+
+class JitteredRetry(Retry):
+    """
+    urllib3 retry configuration which randomizes the exponential backoff between two attempts ("full jitter"), so
+    concurrent clients which failed at the same time don't all retry at the same time as well
+    """
+    def get_backoff_time(self):
+        backoff_time = super(JitteredRetry, self).get_backoff_time()
+        return random.uniform(0, backoff_time)
+
+
+def mount_pooled_adapters(session, pool_connections=10, pool_maxsize=10, pool_block=False, max_retries=3,
+                          backoff_factor=0.5):
+    """
+    mounts http(s) adapters with the given connection pool sizes and retry behaviour on the session
+
+    only idempotent requests are retried, on connection errors as well as on 502, 503 and 504 responses
+    :param session: the requests session (e.g. OAuth2Session)
+    :param pool_connections: number of hosts to keep connection pools for
+    :param pool_maxsize: maximum number of connections kept open per host
+    :param pool_block: whether to wait for a free connection instead of opening more than pool_maxsize per host
+    :param max_retries: maximum number of retries per request
+    :param backoff_factor: the backoff before the n-th retry is (at most) backoff_factor * 2 ^ (n - 1) seconds
+    :return:
+    """
+    retries = JitteredRetry(
+        total=max_retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUS_CODES, raise_on_status=False
+    )
+    for prefix in ('http://', 'https://'):
+        session.mount(prefix, HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block, max_retries=retries
+        ))
+    return session
+
+
+def get_pool_statistics(session):
+    """
+    collects statistics about the connection pools of the session's adapters
+    :param session:
+    :return: dictionary of statistics per pool (identified by scheme, host and port)
+    """
+    statistics = {}
+    for adapter in session.adapters.values():
+        pool_manager = getattr(adapter, 'poolmanager', None)
+        if pool_manager is None:
+            continue
+        for key in pool_manager.pools.keys():
+            pool = pool_manager.pools[key]
+            statistics['{0}://{1}:{2}'.format(pool.scheme, pool.host, pool.port)] = {
+                'max_connections': pool.pool.maxsize if pool.pool else 0,
+                'available_connections': pool.pool.qsize() if pool.pool else 0,
+                'connections_created': pool.num_connections,
+                'requests': pool.num_requests,
+            }
+    return statistics
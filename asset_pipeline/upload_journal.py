@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+from os import path
+
+# journals by the path of their file, so all uploads writing to the same file share one lock
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def get_upload_journal(journal_path):
+    """
+    returns the (shared) upload journal persisted at the given path
+    :param journal_path:
+    :return:
+    """
+    journal_path = path.abspath(journal_path)
+    with _journals_lock:
+        if journal_path not in _journals:
+            _journals[journal_path] = UploadJournal(journal_path)
+        return _journals[journal_path]
+
+
+class UploadJournal(object):
+    """
+    small on-disk journal remembering the upload_id and the last acknowledged offset of running chunked uploads,
+    so an interrupted upload can be continued instead of being started from scratch.
+
+    entries are keyed by the file's path, size and modification time, so a file that changed in the meantime
+    will never be resumed
+    """
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(file_path):
+        """
+        identifies the given file by its path, size and modification time
+        :param file_path:
+        :return:
+        """
+        stat = os.stat(file_path)
+        return '{path}:{size}:{mtime!r}'.format(path=path.abspath(file_path), size=stat.st_size, mtime=stat.st_mtime)
+
+    def get(self, file_path):
+        """
+        returns the journal entry (url, upload_id and offset) for the given file, or None if there is none
+        :param file_path:
+        :return:
+        """
+        with self.lock:
+            return self._read().get(self.get_key(file_path))
+
+    def record(self, file_path, url, upload_id, offset):
+        """
+        remembers that the given file has been uploaded up to offset
+        :param file_path: the file being uploaded
+        :param url: the endpoint to which the file is being uploaded
+        :param upload_id: the id of the upload on the server side
+        :param offset: the number of bytes acknowledged by the server
+        :return:
+        """
+        with self.lock:
+            entries = self._read()
+            entries[self.get_key(file_path)] = {'url': url, 'upload_id': upload_id, 'offset': offset}
+            self._write(entries)
+
+    def remove(self, file_path):
+        """
+        forgets about the upload of the given file (e.g. because it has been committed)
+        :param file_path:
+        :return:
+        """
+        with self.lock:
+            entries = self._read()
+            if entries.pop(self.get_key(file_path), None) is not None:
+                self._write(entries)
+
+    def _read(self):
+        if not path.isfile(self.journal_path):
+            return {}
+        try:
+            with open(self.journal_path) as f:
+                return json.load(f)
+        except ValueError:
+            # a corrupt journal only means we can't resume, so just start over
+            return {}
+
+    def _write(self, entries):
+        directory = path.dirname(self.journal_path)
+        if not path.exists(directory):
+            os.makedirs(directory)
+        # write to a temporary file first, so the journal is never left half-written
+        tmp_path = '{0}.tmp'.format(self.journal_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.rename(tmp_path, self.journal_path)
@@ -0,0 +1,166 @@
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from os import path
+
+from logger import logger
+from result_cache import get_folder_size
+
+
+class WorkingDirectoryFullError(IOError):
+    """
+    raised if there's not enough space left for the working directory of a job
+    """
+    pass
+
+
+class WorkingDirectoryManager(object):
+    """
+    manages the working directories of the jobs (root/<job id>) within a budget of budget bytes.
+
+    directories of finished jobs are kept (e.g. for re-conversions) until their space is needed, then the least
+    recently used ones are removed. Jobs for which there's no space left wait until running jobs finish (and their
+    directories can be removed), at most for timeout seconds. A budget of 0 keeps all directories.
+
+    running jobs are accounted for with the number of bytes they're expected to need, directories are only measured
+    once their jobs are done
+    """
+    def __init__(self, root, budget=0, timeout=60):
+        self.root = root
+        self.budget = budget
+        self.timeout = timeout
+        # number of running jobs using each directory (jobs converting different files of the same asset share it), by
+        # the jobs' ids
+        self.active = {}
+        # number of bytes reserved for the directories in use, by the jobs' ids
+        self.reserved = {}
+        # sizes of the directories of finished jobs, least recently used first
+        self.finished = OrderedDict()
+        # the totals of reserved and finished
+        self.active_size = 0
+        self.finished_size = 0
+        self.condition = threading.Condition(threading.RLock())
+        if self.budget > 0:
+            self._adopt_directories()
+
+    def get_path(self, job_id):
+        return path.join(self.root, str(job_id))
+
+    def acquire(self, job_id, expected_size=0):
+        """
+        provides the working directory of the given job, making space for it if necessary
+        :param job_id:
+        :param expected_size: the number of bytes the job is expected to need
+        :return: the directory's path
+        :raises WorkingDirectoryFullError: if there's not enough space left within timeout seconds
+        """
+        job_id = str(job_id)
+        deadline = time.time() + self.timeout
+        with self.condition:
+            # the directory of a job which is converted again is in use again (with all of its content)
+            previous_size = self.finished.pop(job_id, 0)
+            self.finished_size -= previous_size
+            expected_size = max(expected_size, previous_size)
+            while not self._make_space(expected_size):
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.active:
+                    if previous_size:
+                        self.finished[job_id] = previous_size
+                        self.finished_size += previous_size
+                    raise WorkingDirectoryFullError(
+                        'Not enough space left for the working directory of job {0}'.format(job_id)
+                    )
+                logger.info('Waiting for space for the working directory of job %s' % job_id)
+                self.condition.wait(remaining)
+            self.active[job_id] = self.active.get(job_id, 0) + 1
+            self.reserved[job_id] = self.reserved.get(job_id, 0) + expected_size
+            self.active_size += expected_size
+        directory = self.get_path(job_id)
+        if not path.exists(directory):
+            os.makedirs(directory)
+        return directory
+
+    def release(self, job_id):
+        """
+        marks the working directory of the given job as no longer in use, so it may be removed to make space once no
+        other job uses it either. Must only be called once for every successful call to acquire
+        :param job_id:
+        :return:
+        """
+        job_id = str(job_id)
+        with self.condition:
+            if job_id not in self.active:
+                logger.warn('The working directory of job %s is not in use' % job_id)
+                return
+        directory = self.get_path(job_id)
+        # without a budget, directories are never removed (so there's no need to keep track of them)
+        managed = self.budget > 0 and path.isdir(directory)
+        size = get_folder_size(directory) if managed else 0
+        with self.condition:
+            if job_id not in self.active:
+                # released by another thread in the meantime
+                return
+            count = self.active.pop(job_id) - 1
+            if count > 0:
+                self.active[job_id] = count
+                return
+            self.active_size -= self.reserved.pop(job_id, 0)
+            if managed:
+                self.finished[job_id] = size
+                self.finished_size += size
+                self._make_space(0)
+            self.condition.notify_all()
+
+    def has_space(self, expected_size=0):
+        """
+        whether or not another job needing expected_size bytes fits into the budget (if the directories of all
+        finished jobs were removed)
+        :param expected_size:
+        :return:
+        """
+        if self.budget <= 0:
+            return True
+        with self.condition:
+            return self.active_size + expected_size <= self.budget
+
+    def get_usage(self):
+        """
+        returns the number of bytes used by all working directories
+        :return:
+        """
+        with self.condition:
+            return self.active_size + self.finished_size
+
+    def _make_space(self, required):
+        """
+        removes the directories of finished jobs (least recently used first) until required more bytes fit into
+        the budget
+        :param required:
+        :return: whether or not there's enough space now
+        """
+        if self.budget <= 0:
+            return True
+        while self.get_usage() + required > self.budget and self.finished:
+            job_id, size = self.finished.popitem(last=False)
+            self.finished_size -= size
+            logger.debug('Removing working directory of job %s' % job_id)
+            shutil.rmtree(self.get_path(job_id), ignore_errors=True)
+        return self.get_usage() + required <= self.budget
+
+    def _adopt_directories(self):
+        """
+        takes over the working directories left behind by earlier runs as finished ones, oldest first
+        """
+        if not path.isdir(self.root):
+            return
+        directories = []
+        for name in os.listdir(self.root):
+            directory = path.join(self.root, name)
+            # other files might be kept in the same folder (e.g. caches), only job directories are managed
+            if path.isdir(path.join(directory, 'original')) or path.isdir(path.join(directory, 'converted')):
+                directories.append((os.stat(directory).st_mtime, name))
+        for _, name in sorted(directories):
+            self.finished[name] = get_folder_size(path.join(self.root, name))
+        self.finished_size = sum(self.finished.values())
@@ -38,6 +38,10 @@ setup(name='hub-asset-pipeline',
           'oauthlib-extras',
           'requests'
       ],
+      extras_require={
+          'gevent': ['gevent'],
+          'ujson': ['ujson'],
+      },
       entry_points={
           'console_scripts': ['start-asset-pipeline=asset_pipeline.command_line:main'],
       },